@@ -4,6 +4,26 @@ import re
 
 import numpy as np
 
+# 6x10 glyphs of the message font, one string of rows per letter
+FONT = {
+    "A": "..##.. .#..#. #....# #....# #....# ###### #....# #....# #....# #....#",
+    "B": "#####. #....# #....# #....# #####. #....# #....# #....# #....# #####.",
+    "C": ".####. #....# #..... #..... #..... #..... #..... #..... #....# .####.",
+    "E": "###### #..... #..... #..... #####. #..... #..... #..... #..... ######",
+    "F": "###### #..... #..... #..... #####. #..... #..... #..... #..... #.....",
+    "G": ".####. #....# #..... #..... #..... #..### #....# #....# #...## .###.#",
+    "H": "#....# #....# #....# #....# ###### #....# #....# #....# #....# #....#",
+    "J": "...### ....#. ....#. ....#. ....#. ....#. ....#. #...#. #...#. .###..",
+    "K": "#....# #...#. #..#.. #.#... ##.... ##.... #.#... #..#.. #...#. #....#",
+    "L": "#..... #..... #..... #..... #..... #..... #..... #..... #..... ######",
+    "N": "#....# ##...# ##...# #.#..# #.#..# #..#.# #..#.# #...## #...## #....#",
+    "P": "#####. #....# #....# #....# #####. #..... #..... #..... #..... #.....",
+    "R": "#####. #....# #....# #....# #####. #..#.. #...#. #...#. #....# #....#",
+    "X": "#....# #....# .#..#. .#..#. ..##.. ..##.. .#..#. .#..#. #....# #....#",
+    "Z": "###### .....# .....# ....#. ...#.. ..#... .#.... #..... #..... ######"
+}
+GLYPHS = {tuple(rows.split()): letter for letter, rows in FONT.items()}
+
 class Constellation:
     patt_line = re.compile(r"""position=<\s*(-?\d+),\s+(-?\d+)> velocity=<\s*(-?\d+),\s*(-?\d+)>""")
     
@@ -29,23 +49,86 @@ class Constellation:
     def position(self, t):
         return self.px + self.vx * t, self.py + self.vy * t
     
-    def find_min_area(self):
-        px = self.px
-        py = self.py
-        area = (max(px) - min(px)) * (max(py) - min(py))
-        last_area = area + 1
-        t = 0
-        while last_area > area:
-            lastx, lasty = px, py
-            t += 1
-            last_area = area
-            px, py = self.position(t)
-            area = (max(px) - min(px)) * (max(py) - min(py))
-            print("%d %d" % (t, area))
-        return lastx, lasty
+    def area(self, t):
+        px, py = self.position(t)
+        return (px.max() - px.min()) * (py.max() - py.min())
+    
+    def estimate_time(self):
+        """Least-squares estimate of when the points are closest together:
+        the t minimising the summed squared distance from the centroid."""
+        dx = self.px - self.px.mean()
+        dy = self.py - self.py.mean()
+        dvx = self.vx - self.vx.mean()
+        dvy = self.vy - self.vy.mean()
+        vv = (dvx * dvx + dvy * dvy).sum()
+        if vv == 0:
+            return 0
+        return -(dx * dvx + dy * dvy).sum() / vv
+    
+    def find_min_area(self, window=8):
+        """Find the time of the smallest bounding box, starting from the
+        least-squares estimate and refining with an integer ternary search
+        over a window around it (widened if the minimum sits on an
+        edge)."""
+        t0 = max(0, int(round(self.estimate_time())))
+        while True:
+            lo, hi = max(0, t0 - window), t0 + window
+            a, b = lo, hi
+            while b - a > 2:
+                m1 = a + (b - a) // 3
+                m2 = b - (b - a) // 3
+                if self.area(m1) <= self.area(m2):
+                    b = m2
+                else:
+                    a = m1
+            t = min(range(a, b + 1), key=self.area)
+            if (t > lo or lo == 0) and t < hi:
+                break
+            t0 = t
+            window *= 2
+        self.t = t
+        return self.position(t)
+    
+    def render(self, t=None):
+        """Boolean bitmap of the points at time t (default: the time found
+        by find_min_area), indexed [y,x] from the top-left point."""
+        if t is None:
+            t = self.t
+        px, py = self.position(t)
+        bitmap = np.zeros((py.max() - py.min() + 1, px.max() - px.min() + 1), dtype=bool)
+        bitmap[py - py.min(), px - px.min()] = True
+        return bitmap
+    
+    @staticmethod
+    def to_text(bitmap):
+        return "\n".join("".join("#" if v else "." for v in row) for row in bitmap)
+    
+    @staticmethod
+    def read(bitmap):
+        """Decode a bitmap of 6x10 letters spaced 8 columns apart, with '?'
+        for anything not in the font."""
+        height, width = bitmap.shape
+        if height != 10:
+            return "?"
+        padded = np.zeros((height, -(-width // 8) * 8), dtype=bool)
+        padded[:,:width] = bitmap
+        out = []
+        for i in range(0, padded.shape[1], 8):
+            glyph = tuple("".join("#" if v else "." for v in row)
+                          for row in padded[:,i:i+6])
+            out.append(GLYPHS.get(glyph, "?"))
+        return "".join(out)
+    
+    def message(self):
+        self.find_min_area()
+        return self.read(self.render())
     
 t = Constellation("test.txt")
 x, y = t.find_min_area()
+print("test: t=%d" % (t.t,))
 
 t2 = Constellation("input.txt")
-x2, y2 = t2.find_min_area()
\ No newline at end of file
+x2, y2 = t2.find_min_area()
+print("input: t=%d" % (t2.t,))
+print(Constellation.to_text(t2.render()))
+print("message: %s" % (t2.message(),))
\ No newline at end of file
@@ -1,7 +1,47 @@
 # -*- coding: utf-8 -*-
 
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
 import numpy as np
 
+def power_grids(serials, gridsize=300):
+    """Stack of power grids, indexed [serial, j, i]."""
+    serials = np.asarray(serials)[:,None,None]
+    x = np.arange(1, gridsize+1)
+    y = np.arange(1, gridsize+1)[:,None]
+    rack_id = x + 10
+    power = (rack_id * y + serials) * rack_id
+    return (power // 100) % 10 - 5
+
+def window_sums(psum, size):
+    """Sums of every size x size square, indexed [..., j, i] by the 0-based
+    position of the top-left corner, from summed-area tables (stacked
+    along any leading axes) padded with a leading row/column of zeros."""
+    p = psum
+    return (p[...,size:,size:] - p[...,:-size,size:]
+            - p[...,size:,:-size] + p[...,:-size,:-size])
+
+def best_window(psum, size):
+    """Best (power, x, y) square of the given size, from a summed-area
+    table padded with a leading row/column of zeros."""
+    sums = window_sums(psum, size)
+    # scan x-major like the original loops, so ties go to the smallest x
+    i, j = np.unravel_index(sums.T.argmax(), sums.T.shape)
+    return int(sums[j,i]), int(i)+1, int(j)+1
+
+# summed-area table shared with pool workers
+_shared = {}
+
+def _attach_psum(name, shape, dtype):
+    shm = shared_memory.SharedMemory(name=name)
+    _shared["shm"] = shm
+    _shared["psum"] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+def _best_shared(size):
+    return best_window(_shared["psum"], size)
+
 class Grid:
     def __init__(self, serial, gridsize=300):
         self.serial = serial
@@ -10,17 +50,7 @@ class Grid:
         self._init_sumgrid()
         
     def _init_grid(self):
-        self.grid = np.zeros((self.gridsize, self.gridsize), dtype=int)
-        for i in range(self.gridsize):
-            for j in range(self.gridsize):
-                x = i + 1
-                y = j + 1
-                rack_id = x + 10
-                power = rack_id * y
-                power += self.serial
-                power = ((power * rack_id) // 100) % 10
-                power -= 5
-                self.grid[j,i] = power
+        self.grid = power_grids([self.serial], self.gridsize)[0]
     
     @staticmethod
     def bget(grid, i, j):
@@ -30,13 +60,11 @@ class Grid:
             return grid[j,i]
     
     def _init_sumgrid(self):
-        self.sumgrid = np.zeros((self.gridsize, self.gridsize), dtype=int)
-        for i in range(self.gridsize):
-            for j in range(self.gridsize):
-                self.sumgrid[j,i] = (self.bget(self.grid, i, j)
-                    + self.bget(self.sumgrid, i, j-1) 
-                    + self.bget(self.sumgrid, i-1, j)
-                    - self.bget(self.sumgrid, i-1, j-1))
+        self.sumgrid = self.grid.cumsum(axis=0).cumsum(axis=1)
+        # summed-area table with a leading row/column of zeros, so window
+        # sums need no bounds checks
+        self.psum = np.zeros((self.gridsize+1, self.gridsize+1), dtype=int)
+        self.psum[1:,1:] = self.sumgrid
     
     def get(self, x, y):
         return self.grid[y-1,x-1]
@@ -47,58 +75,137 @@ class Grid:
                 - self.bget(self.sumgrid, i+width-1, j-1)
                 - self.bget(self.sumgrid, i-1, j+width-1))
     
+    def findmax_size(self, size):
+        return best_window(self.psum, size)
+    
     def findmax(self):
-        pmax, xmax, ymax = 0, 0, 0
-        for i in range(self.gridsize-2):
-            for j in range(self.gridsize-2):
-                x = i+1
-                y = j+1
-                #print(self.grid[j:j+3,i:i+3])
-                p = self.getsum(i, j, 3)
-                if (p > pmax):
-                    pmax = p
-                    xmax = x
-                    ymax = y
-        return pmax, xmax, ymax
+        return self.findmax_size(3)
+    
+    def _tighten(self, bounds, size, best):
+        """Tighten the upper bounds for larger sizes now that the best
+        size x size sum is known: an s x s square holds k*k disjoint
+        size x size squares (k = s // size), and every leftover cell is at
+        most the largest cell value."""
+        s = np.arange(size+1, self.gridsize+1)
+        k = s // size
+        cand = k*k*best + (s*s - k*k*size*size) * self.gmax
+        bounds[size+1:] = np.minimum(bounds[size+1:], cand)
     
-    def findmaxvar(self):
-        pmax, xmax, ymax, smax = 0, 0, 0, 0
-        for size in range(3, 301):
-            #if (size % 10 == 0):
-            #    print(size)
-            for i in range(self.gridsize-size-1):
-                for j in range(self.gridsize-size-1):
-                    x = i+1
-                    y = j+1
-                    p = self.getsum(i, j, size)
-                    if (p > pmax):
-                        pmax = p
-                        xmax = x
-                        ymax = y
-                        smax = size
+    def findmaxvar(self, workers=1, chunk=None):
+        """Best square of any size.  Sizes are checked smallest first, in
+        batches of chunk sizes spread over a pool of workers processes
+        (sharing the summed-area table) when workers > 1.  Sizes whose
+        upper bound cannot beat the best sum found so far are skipped."""
+        self.gmax = int(self.grid.max())
+        sizes = np.arange(self.gridsize+1)
+        bounds = sizes * sizes * max(self.gmax, 0)
+        if chunk is None:
+            chunk = max(workers, 1) * 4
+        pending = list(range(1, self.gridsize+1))
+        pmax, xmax, ymax, smax = None, 0, 0, 0
+        shm = None
+        pool = None
+        try:
+            if workers > 1:
+                shm = shared_memory.SharedMemory(create=True, size=self.psum.nbytes)
+                shared = np.ndarray(self.psum.shape, dtype=self.psum.dtype, buffer=shm.buf)
+                shared[:] = self.psum
+                pool = ProcessPoolExecutor(workers, initializer=_attach_psum,
+                                           initargs=(shm.name, self.psum.shape, self.psum.dtype))
+                mapper = pool.map
+            else:
+                mapper = lambda f, sizes: [self.findmax_size(s) for s in sizes]
+            while pending:
+                if pmax is not None:
+                    pending = [s for s in pending if bounds[s] > pmax]
+                batch, pending = pending[:chunk], pending[chunk:]
+                for size, (p, x, y) in zip(batch, mapper(_best_shared, batch)):
+                    if pmax is None or p > pmax:
+                        pmax, xmax, ymax, smax = p, x, y, size
+                    self._tighten(bounds, size, p)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            if shm is not None:
+                shm.close()
+                shm.unlink()
         return pmax, xmax, ymax, smax
 
-tests = [
-        ( 8,   3,   5,  4),
-        (57, 122,  79, -5),
-        (39, 217, 196,  0),
-        (71, 101, 153,  4)
-        ]
-for serial, x, y, expect in tests:
-    g = Grid(serial)
-    out = g.get(x, y)
-    print("Grid(%d).get(%d, %d) should equal %d (%s)" % (serial, x, y, expect, out == expect))
-
-g = Grid(18)
-print(g.grid)
-print(g.sumgrid)
-print("Grid(18) 3x3 power=%d x,y=%d,%d" % g.findmax())
-print("Grid(18) NxN power=%d x,y,N=%d,%d,%d" % g.findmaxvar())
-
-g = Grid(42)
-print("Grid(42) 3x3 power=%d x,y=%d,%d" % g.findmax())
-print("Grid(42) NxN power=%d x,y,N=%d,%d,%d" % g.findmaxvar())
-
-g = Grid(9110)
-print("Grid(9110) 3x3 power=%d x,y=%d,%d" % g.findmax())
-print("Grid(9110) NxN power=%d x,y,N=%d,%d,%d" % g.findmaxvar())
\ No newline at end of file
+class GridSolver:
+    """Best 3x3 and NxN squares for many serials at once, computed over a
+    3-D stack of grids and kept in an LRU cache keyed by (serial,
+    gridsize)."""
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+
+    @staticmethod
+    def _best(sums):
+        """Best (power, x, y) per serial in a [serial, j, i] stack of window
+        sums, ties going to the smallest x then y."""
+        n = sums.shape[0]
+        flat = sums.transpose(0, 2, 1).reshape(n, -1)
+        k = flat.argmax(axis=1)
+        i, j = np.unravel_index(k, sums.shape[2:0:-1])
+        return flat[np.arange(n), k], i+1, j+1
+
+    def _solve(self, serials, gridsize):
+        grids = power_grids(serials, gridsize)
+        n = len(serials)
+        psum = np.zeros((n, gridsize+1, gridsize+1), dtype=int)
+        psum[:,1:,1:] = grids.cumsum(axis=1).cumsum(axis=2)
+        best3 = None
+        bestn = [None] * n
+        for size in range(1, gridsize+1):
+            sums = window_sums(psum, size)
+            p, x, y = self._best(sums)
+            if size == 3:
+                best3 = [(int(p[k]), int(x[k]), int(y[k])) for k in range(n)]
+            for k in range(n):
+                if bestn[k] is None or p[k] > bestn[k][0]:
+                    bestn[k] = (int(p[k]), int(x[k]), int(y[k]), size)
+        return [(best3[k], bestn[k]) for k in range(n)]
+
+    def solve(self, serials, gridsize=300):
+        """List of ((power, x, y), (power, x, y, size)) for each serial."""
+        missing = sorted({s for s in serials if (s, gridsize) not in self.cache})
+        if missing:
+            for s, result in zip(missing, self._solve(missing, gridsize)):
+                self.cache[(s, gridsize)] = result
+        out = []
+        for s in serials:
+            self.cache.move_to_end((s, gridsize))
+            out.append(self.cache[(s, gridsize)])
+        while len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return out
+
+if __name__ == "__main__":
+    tests = [
+            ( 8,   3,   5,  4),
+            (57, 122,  79, -5),
+            (39, 217, 196,  0),
+            (71, 101, 153,  4)
+            ]
+    for serial, x, y, expect in tests:
+        g = Grid(serial)
+        out = g.get(x, y)
+        print("Grid(%d).get(%d, %d) should equal %d (%s)" % (serial, x, y, expect, out == expect))
+
+    g = Grid(18)
+    print(g.grid)
+    print(g.sumgrid)
+    print("Grid(18) 3x3 power=%d x,y=%d,%d" % g.findmax())
+    print("Grid(18) NxN power=%d x,y,N=%d,%d,%d" % g.findmaxvar())
+
+    g = Grid(42)
+    print("Grid(42) 3x3 power=%d x,y=%d,%d" % g.findmax())
+    print("Grid(42) NxN power=%d x,y,N=%d,%d,%d" % g.findmaxvar())
+
+    g = Grid(9110)
+    print("Grid(9110) 3x3 power=%d x,y=%d,%d" % g.findmax())
+    print("Grid(9110) NxN power=%d x,y,N=%d,%d,%d" % g.findmaxvar())
+
+    solver = GridSolver()
+    for serial, (best3, bestn) in zip([18, 42, 9110], solver.solve([18, 42, 9110])):
+        print("batch %d 3x3 power=%d x,y=%d,%d NxN power=%d x,y,N=%d,%d,%d" % ((serial,) + best3 + bestn))
\ No newline at end of file
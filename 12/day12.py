@@ -1,36 +1,53 @@
 # -*- coding: utf-8 -*-
 
 import re
-from collections import deque
-from scipy.stats import linregress
+
+import numpy as np
+
+def rule_table(rules):
+    """32-entry table indexed by the 5-bit neighbourhood of a pot, with the
+    leftmost pot as the high bit."""
+    table = [False] * 32
+    for window, out in rules.items():
+        code = 0
+        for c in window:
+            code = (code << 1) | (c == '#')
+        table[code] = (out == '#')
+    if table[0]:
+        raise Exception("empty neighbourhood grows a plant")
+    return table
 
 class State:
-    def __init__(self, s, start):
+    """Row of pots held as a big int, bit j being pot start + j.  The low
+    bit is always a plant (unless the row is empty)."""
+    def __init__(self, s, start, bits=None):
+        if bits is None:
+            bits = 0
+            for i, c in enumerate(s):
+                if c == '#':
+                    bits |= 1 << i
         self.start = start
-        self.deque = deque([c for c in s])
-        self.end = start + len(self.deque)
+        self.bits = bits
+        self._normalize()
+
+    def _normalize(self):
+        if self.bits:
+            tz = (self.bits & -self.bits).bit_length() - 1
+            self.bits >>= tz
+            self.start += tz
+        self.end = self.start + self.bits.bit_length()
 
     def first(self):
-        i = 0
-        c = self.deque[i]
-        while c != '#':
-            i += 1
-            c = self.deque[i]
-        return i + self.start
+        return self.start
 
     def last(self):
-        i = self.end - 1 - self.start
-        c = self.deque[i]
-        while c != '#':
-            i -= 1
-            c = self.deque[i]
-        return i + self.start
+        return self.end - 1
 
     def get(self, i):
         if i < self.start or i >= self.end:
             return "."
         else:
-            return self.deque[i-self.start]
+            return "#" if (self.bits >> (i - self.start)) & 1 else "."
 
     def get_window(self, s, e):
         out = []
@@ -43,38 +60,99 @@ class State:
             start = self.start
         if end == None:
             end = self.end
-        if start < self.start:
-            for _ in range(self.start - start):
-                print(".", end="")
-        print("".join(self.deque), end="")
-        if end > self.end:
-            for _ in range(end - self.end):
-                print(".", end="")
-        print("")
-      
-    def debug(self):    
+        print(self.get_window(start, end))
+
+    def debug(self):
         for i in range(self.start-5, self.end+5):
-            print("%3d %s" % (i, s.get(i)))
-            
+            print("%3d %s" % (i, self.get(i)))
+
     def next(self, rules):
-        start = self.first()-3
-        out = []
-        for i in range(start, self.last()+4):
-            window = self.get_window(i-2, i+3)
-            if window in rules and rules[window] == '#':
-                out.append('#')
-            else:
-                out.append('.')
-            #print("%3d %s => %s" % (i, window, out))
-        return State("".join(out), start)
+        """Apply the rules to every pot at once: for each neighbourhood
+        that grows a plant, AND together the (possibly inverted) row
+        shifted to each of the five offsets, and OR the results."""
+        table = rules if isinstance(rules, list) else rule_table(rules)
+        # bit i of b is pot (start - 4 + i); output covers start-2..end+1
+        b = self.bits << 4
+        width = b.bit_length() + 4
+        mask = (1 << width) - 1
+        shifted = [b << 2, b << 1, b, b >> 1, b >> 2]
+        inverted = [~s & mask for s in shifted]
+        out = 0
+        for code in range(1, 32):
+            if not table[code]:
+                continue
+            term = mask
+            for k in range(5):
+                term &= shifted[k] if (code >> (4 - k)) & 1 else inverted[k]
+            out |= term
+        return State(None, self.start - 4, bits=out)
+
+    def key(self):
+        return self.bits
+
+    def moved(self, shift):
+        return State(None, self.start + shift, bits=self.bits)
 
     def score(self):
         s = 0
-        for i, c in enumerate(self.deque):
-            if c == '#':
-                s += (i + self.start)
+        bits = self.bits
+        n = self.start
+        while bits:
+            if bits & 1:
+                s += n
+            bits >>= 1
+            n += 1
         return s
 
+class ArrayState:
+    """Row of pots held as a uint8 NumPy array starting at pot start,
+    trimmed so the first and last cells are plants.  next() works on the
+    whole row at once, for rows far wider than State handles well."""
+    WEIGHTS = np.array([1, 2, 4, 8, 16], dtype=np.uint8)
+
+    def __init__(self, cells, start):
+        nz = np.flatnonzero(cells)
+        if len(nz):
+            cells = cells[nz[0]:nz[-1]+1]
+            start += int(nz[0])
+        else:
+            cells = cells[:0]
+        self.cells = cells
+        self.start = start
+        self.end = start + len(cells)
+
+    @staticmethod
+    def from_state(state):
+        cells = np.array([state.get(i) == '#' for i in range(state.start, state.end)],
+                         dtype=np.uint8)
+        return ArrayState(cells, state.start)
+
+    def first(self):
+        return self.start
+
+    def last(self):
+        return self.end - 1
+
+    def next(self, rules):
+        """Neighbourhood codes for every pot from one convolution over the
+        row padded by four empty pots each side (the kernel is reversed by
+        convolve, so the leftmost pot gets weight 16), then a table
+        lookup."""
+        table = rules if isinstance(rules, list) else rule_table(rules)
+        padded = np.pad(self.cells, 4)
+        codes = np.convolve(padded, self.WEIGHTS, mode="valid")
+        out = np.take(np.array(table, dtype=np.uint8), codes)
+        return ArrayState(out, self.start - 2)
+
+    def key(self):
+        return self.cells.tobytes()
+
+    def moved(self, shift):
+        return ArrayState(self.cells, self.start + shift)
+
+    def score(self):
+        return int((np.flatnonzero(self.cells) + self.start).sum())
+
 def parse(filename):
     patt_state = re.compile(r"""initial state:\s+(.+)""")
     patt_rule = re.compile(r"""(.+) => (.)""")
@@ -90,7 +168,7 @@ def parse(filename):
             if m:
                 rules[m.group(1)] = m.group(2)
     return state, rules
-        
+
 ts, trules = parse("test.txt")
 
 def run_n(state, rules, n=20):
@@ -101,8 +179,9 @@ def run_n(state, rules, n=20):
     gen.append(0)
     scores.append(state.score())
     s = state
+    table = rule_table(rules)
     for i in range(n):
-        s = s.next(rules)
+        s = s.next(table)
         slist.append(s)
         gen.append(i+1)
         scores.append(s.score())
@@ -111,13 +190,40 @@ def run_n(state, rules, n=20):
         #print("%5d " % (s.score(),), end="")
         #s.pprint(start=-10)
 
-    return gen, scores 
-    
-run_n(ts, trules)
+    return gen, scores
 
-s, rules = parse("input.txt")
+def state_at(state, rules, n):
+    """State (or ArrayState) after n generations.  Once a pattern repeats
+    up to a shift, the remaining generations are skipped by moving the
+    repeated pattern along by the shift for each skipped period."""
+    table = rule_table(rules)
+    seen = {}
+    s = state
+    g = 0
+    while g < n:
+        key = s.key()
+        if key in seen:
+            g0, start0 = seen[key]
+            period = g - g0
+            shift = s.start - start0
+            cycles = (n - g) // period
+            s = s.moved(shift * cycles)
+            g += period * cycles
+            # finish any leftover generations directly
+            while g < n:
+                s = s.next(table)
+                g += 1
+            return s
+        seen[key] = (g, s.start)
+        s = s.next(table)
+        g += 1
+    return s
+
+gen, tscores = run_n(ts, trules)
+print("test, 20 generations: %d" % (tscores[20],))
 
-gen, scores = run_n(s, rules, 1000) 
+s, rules = parse("input.txt")
 
-lr = linregress(gen[200:1000], scores[200:1000])
-print(int(lr.slope * 50_000_000_000) + int(lr.intercept))
\ No newline at end of file
+print("part 1: %d" % (state_at(s, rules, 20).score(),))
+print("part 2: %d" % (state_at(s, rules, 50_000_000_000).score(),))
+print("part 2 (array engine): %d" % (state_at(ArrayState.from_state(s), rules, 50_000_000_000).score(),))
@@ -114,6 +114,42 @@ class Cart:
         else:
             return None
 
+# integer direction codes are the Dir values
+DX = [0, -1, 0, 1]
+DY = [-1, 0, 1, 0]
+TRACK_CHARS = " -|/\\+"
+
+def build_turn_table():
+    """Flat table of the new direction for (track char, direction,
+    intersection counter % 3), indexed (code * 4 + dir) * 3 + counter.
+    Directions a cart cannot have on a track char (and any cell off the
+    track) are -1."""
+    horizontal = (Dir.LEFT, Dir.RIGHT)
+    table = []
+    for t in TRACK_CHARS:
+        for d in Dir:
+            for i in range(3):
+                if t == '-':
+                    nd = d if d in horizontal else None
+                elif t == '|':
+                    nd = None if d in horizontal else d
+                elif t == '/':
+                    nd = Cart.ccw[d] if d in horizontal else Cart.cw[d]
+                elif t == '\\':
+                    nd = Cart.cw[d] if d in horizontal else Cart.ccw[d]
+                elif t == '+':
+                    nd = [Cart.ccw[d], d, Cart.cw[d]][i]
+                else:
+                    nd = None
+                table.append(-1 if nd is None else nd.value)
+    return table
+
+TURN = build_turn_table()
+
+# offsets of every cell a cart could collide from within one tick
+NEAR = [(dy, dx) for dy in range(-2, 3) for dx in range(-2, 3)
+        if 0 < abs(dy) + abs(dx) <= 2]
+
 class Track:
     def __init__(self, filename):
         self.ncol = 0
@@ -176,6 +212,127 @@ class Track:
                     print(self.grid[j,i], end="")
             print()
     
+    def simulate(self, first_crash=True):
+        """Run a copy of the carts on integer state: flat grid positions,
+        Dir values, intersection counters and a live position -> cart dict
+        for collisions.  Crashed carts are dropped when the next tick's
+        order is built.  Returns the (x, y) of the first crash, or with
+        first_crash=False of the last cart left."""
+        width = self.ncol
+        codes = {c: n for n, c in enumerate(TRACK_CHARS)}
+        code = [codes.get(c, 0) for c in self.grid.flatten()]
+        plus = codes['+']
+        step = [DY[d] * width + DX[d] for d in range(4)]
+        pos = [c.y * width + c.x for c in self.carts]
+        dirs = [c.d.value for c in self.carts]
+        inters = [c.inters % 3 for c in self.carts]
+        alive = [True] * len(self.carts)
+        occupied = {p: i for i, p in enumerate(pos)}
+        order = list(range(len(self.carts)))
+        while True:
+            # flat positions sort in reading order
+            order = sorted((i for i in order if alive[i]), key=pos.__getitem__)
+            if not first_crash and len(order) <= 1:
+                break
+            for i in order:
+                if not alive[i]:
+                    continue
+                p = pos[i]
+                del occupied[p]
+                c = code[p]
+                d = TURN[(c * 4 + dirs[i]) * 3 + inters[i]]
+                if d < 0:
+                    raise Exception("bad dir at %d,%d" % (p % width, p // width))
+                if c == plus:
+                    inters[i] = (inters[i] + 1) % 3
+                dirs[i] = d
+                p += step[d]
+                pos[i] = p
+                if p in occupied:
+                    j = occupied.pop(p)
+                    alive[i] = alive[j] = False
+                    if first_crash:
+                        return (p % width, p // width)
+                else:
+                    occupied[p] = i
+        if not order:
+            return None
+        p = pos[order[0]]
+        return (p % width, p // width)
+
+    def simulate_arrays(self, first_crash=True):
+        """Same as simulate, with the track as a uint8 code grid and the
+        carts as parallel NumPy arrays ordered each tick with lexsort.
+        Carts with no other cart within two steps cannot collide this
+        tick, so they all move in one batch; only the rest move one at a
+        time in reading order."""
+        grid = np.zeros(self.grid.shape, dtype=np.uint8)
+        for n, c in enumerate(TRACK_CHARS):
+            grid[self.grid == c] = n
+        plus = TRACK_CHARS.index('+')
+        turn = np.array(TURN, dtype=np.int8).reshape(len(TRACK_CHARS), 4, 3)
+        dx = np.array(DX)
+        dy = np.array(DY)
+        n = len(self.carts)
+        x = np.array([c.x for c in self.carts], dtype=int)
+        y = np.array([c.y for c in self.carts], dtype=int)
+        d = np.array([c.d.value for c in self.carts], dtype=int)
+        t = np.array([c.inters % 3 for c in self.carts], dtype=int)
+        alive = np.ones(n, dtype=bool)
+        # occupancy grid, padded by two cells so neighbour checks need no
+        # bounds tests
+        occ = np.full((self.nrow + 4, self.ncol + 4), -1, dtype=int)
+        occ[y + 2, x + 2] = np.arange(n)
+        while True:
+            idx = np.flatnonzero(alive)
+            if not first_crash and len(idx) <= 1:
+                break
+            idx = idx[np.lexsort((x[idx], y[idx]))]
+            near = np.zeros(len(idx), dtype=bool)
+            for oy, ox in NEAR:
+                near |= occ[y[idx] + 2 + oy, x[idx] + 2 + ox] >= 0
+
+            far = idx[~near]
+            occ[y[far] + 2, x[far] + 2] = -1
+            c = grid[y[far], x[far]]
+            nd = turn[c, d[far], t[far]]
+            if (nd < 0).any():
+                k = far[np.argmax(nd < 0)]
+                raise Exception("bad dir at %d,%d" % (x[k], y[k]))
+            t[far] = np.where(c == plus, (t[far] + 1) % 3, t[far])
+            d[far] = nd
+            x[far] += dx[nd]
+            y[far] += dy[nd]
+            occ[y[far] + 2, x[far] + 2] = far
+
+            for i in idx[near]:
+                if not alive[i]:
+                    continue
+                xi, yi = int(x[i]), int(y[i])
+                occ[yi + 2, xi + 2] = -1
+                c = int(grid[yi, xi])
+                di = TURN[(c * 4 + int(d[i])) * 3 + int(t[i])]
+                if di < 0:
+                    raise Exception("bad dir at %d,%d" % (xi, yi))
+                if c == plus:
+                    t[i] = (t[i] + 1) % 3
+                d[i] = di
+                xi += DX[di]
+                yi += DY[di]
+                x[i], y[i] = xi, yi
+                other = occ[yi + 2, xi + 2]
+                if other >= 0:
+                    alive[i] = alive[other] = False
+                    occ[yi + 2, xi + 2] = -1
+                    if first_crash:
+                        return (xi, yi)
+                else:
+                    occ[yi + 2, xi + 2] = i
+        idx = np.flatnonzero(alive)
+        if not len(idx):
+            return None
+        return (int(x[idx[0]]), int(y[idx[0]]))
+
     def run_to_crash(self, verbose=False):
         collision = False
         t = 0
@@ -221,13 +378,15 @@ class Track:
         print("last cart %s" % (self.carts[0],))
             
 t = Track("test.txt")
+print(t.simulate(), t.simulate_arrays())
 print(t.run_to_crash(verbose=True))
 
 inp = Track("input.txt")
-print(inp.run_to_crash())
+print("first crash: %s" % (inp.simulate(),))
 
 t2 = Track("test2.txt")
+print(t2.simulate(first_crash=False), t2.simulate_arrays(first_crash=False))
 t2.run_to_all_crash(verbose=True)
 
 inp2 = Track("input.txt")
-inp2.run_to_all_crash()
\ No newline at end of file
+print("last cart: %s" % (inp2.simulate(first_crash=False),))
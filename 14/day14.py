@@ -1,46 +1,91 @@
 # -*- coding: utf-8 -*-
 
+def kmp_table(pattern):
+    """Failure function: length of the longest proper prefix of
+    pattern[:i+1] that is also a suffix of it."""
+    fail = [0] * len(pattern)
+    k = 0
+    for i in range(1, len(pattern)):
+        while k and pattern[i] != pattern[k]:
+            k = fail[k-1]
+        if pattern[i] == pattern[k]:
+            k += 1
+        fail[i] = k
+    return fail
+
+# digits written for each possible sum of two scores: the first digit, the
+# second (only kept when the sum has two digits), and how many to keep
+SPLIT_HEAD  = bytes(s if s < 10 else 1 for s in range(19))
+SPLIT_TAIL  = bytes(0 if s < 10 else s - 10 for s in range(19))
+SPLIT_WIDTH = bytes(1 if s < 10 else 2 for s in range(19))
+
 class ChocChart:
+    CHUNK = 1 << 16
+    
     def __init__(self):
-        self.array  = [3, 7]
+        self.array  = bytearray([3, 7, 0, 0])
+        self.n      = 2
         self.elfpos = [0, 1]
         self.nelves = len(self.elfpos)
         
-    def add_recipe(self):
-        s = self.array[self.elfpos[0]] + self.array[self.elfpos[1]]
-        if s >= 10:
-            self.array.append(1)
-        self.array.append(s % 10)
-        
-    def move_elves(self):
-        lenarray = len(self.array)
-        for i in range(self.nelves):
-            steps = self.array[self.elfpos[i]] + 1
-            endsteps = lenarray-1-self.elfpos[i]
-            if steps > endsteps:
-                steps = steps - endsteps
-                self.elfpos[i] = steps % lenarray - 1
-            else:
-                self.elfpos[i] += steps
-
+    def _reserve(self, size):
+        """Grow the buffer geometrically so it holds at least size
+        recipes plus the spare byte extend() writes past the end."""
+        if len(self.array) < size + 2:
+            grow = max(size + 2, 2 * len(self.array)) - len(self.array)
+            self.array.extend(bytes(grow))
+    
+    def extend(self, n):
+        """Add rounds of recipes until at least n more exist."""
+        target = self.n + n
+        self._reserve(target + 1)
+        buf = self.array
+        size = self.n
+        a, b = self.elfpos
+        head, tail, width = SPLIT_HEAD, SPLIT_TAIL, SPLIT_WIDTH
+        while size < target:
+            x = buf[a]
+            y = buf[b]
+            s = x + y
+            buf[size] = head[s]
+            buf[size+1] = tail[s]
+            size += width[s]
+            a = (a + x + 1) % size
+            b = (b + y + 1) % size
+        self.n = size
+        self.elfpos = [a, b]
+    
     def step(self):
-        self.add_recipe()
-        self.move_elves()
+        self.extend(1)
 
     def get(self, l, n):
-        while len(self.array) < n + l+1:
-            self.step()
+        if self.n < n + l+1:
+            self.extend(n + l+1 - self.n)
         return "".join([str(n) for n in self.array[n:n+l]])
         
     def find(self, s):
-        window = len(s)
+        """Index of the first occurrence of the digit string s, matched one
+        recipe at a time with a KMP automaton as the scoreboard grows."""
+        pattern = bytes(int(c) for c in s)
+        fail = kmp_table(pattern)
+        array = self.array
+        k = 0
         i = 0
-        while s != self.get(window, i):
+        while True:
+            if i >= self.n:
+                self.extend(self.CHUNK)
+                array = self.array
+            c = array[i]
+            while k and pattern[k] != c:
+                k = fail[k-1]
+            if pattern[k] == c:
+                k += 1
             i += 1
-        return i
+            if k == len(pattern):
+                return i - k
     
     def pprint(self):
-        for i, n in enumerate(self.array):
+        for i, n in enumerate(self.array[:self.n]):
             if i == self.elfpos[0]:
                 print("(%d)" % (n,), end="")
             elif i == self.elfpos[1]:
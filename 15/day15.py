@@ -1,7 +1,9 @@
-from collections import namedtuple, defaultdict, deque
-import copy
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from operator import attrgetter
+import os
 import time
-from typing import Dict, Tuple, Set
+from typing import Dict, Tuple
 
 import numpy as np
 
@@ -10,12 +12,16 @@ Pos = namedtuple("Pos", ["x", "y"])
 EndState = namedtuple("EndState", ["steps", "remaining_hp", "outcome", "n_goblins", "n_elves", "status"])
 
 class Unit:
+    """A unit; idx is its flat cell index in the map it stands on."""
     ELF, GOBLIN = 0, 1
 
-    def __init__(self, type=ELF, hp=200, ap=3):
+    __slots__ = ("type", "hp", "ap", "idx")
+
+    def __init__(self, type=ELF, hp=200, ap=3, idx=-1):
         self.type = type
         self.hp = hp
         self.ap = ap
+        self.idx = idx
 
     def as_char(self) -> str:
         if self.type == Unit.ELF:
@@ -47,6 +53,8 @@ class Map:
         self.grid = None
         self.init_units: Dict[Pos, Unit] = dict()
         self._init_grid(self.filename)
+        self._init_graph()
+        self.snapshot = [(pos, u.type, u.hp, u.ap) for pos, u in self.init_units.items()]
         self.reset()
 
     def _init_grid(self, filename):
@@ -75,11 +83,72 @@ class Map:
                     self.init_units[Pos(i,j)] = Unit(type=Unit.ELF)
                     self.grid[j,i] = "."
 
-    def reset(self):
-        self.units = copy.deepcopy(self.init_units)
+    def _init_graph(self):
+        """Flat cell indices (y * ncol + x, so index order is reading
+        order), the open neighbours of every cell in reading order, and
+        the stamp arrays the BFS reuses between calls."""
+        size = self.nrow * self.ncol
+        self.nbrs = [[] for _ in range(size)]
+        for j in range(self.nrow):
+            for i in range(self.ncol):
+                if self.grid[j,i] == "#":
+                    continue
+                for dx, dy in [(0, -1), (-1, 0), (1, 0), (0, 1)]:
+                    nx, ny = i + dx, j + dy
+                    if 0 <= nx < self.ncol and 0 <= ny < self.nrow and self.grid[ny,nx] != "#":
+                        self.nbrs[j*self.ncol+i].append(ny*self.ncol+nx)
+        self.seen = [0] * size
+        self.is_target = [0] * size
+        self.gen = 0
+
+    def index(self, pos: Pos) -> int:
+        return pos.y * self.ncol + pos.x
+
+    def pos(self, idx: int) -> Pos:
+        return Pos(idx % self.ncol, idx // self.ncol)
+
+    def _bfs_nearest(self, start: int, goals) -> int:
+        """BFS out from start over free cells, level by level, returning
+        the first cell in reading order among the nearest cells for which
+        goals[cell] is the current generation (or None)."""
+        gen = self.gen
+        seen = self.seen
+        nbrs = self.nbrs
+        occ = self.occ
+        seen[start] = gen
+        frontier = [start]
+        while frontier:
+            found = []
+            nxt = []
+            for c in frontier:
+                for n in nbrs[c]:
+                    if seen[n] != gen and occ[n] is None:
+                        seen[n] = gen
+                        nxt.append(n)
+                        if goals[n] == gen:
+                            found.append(n)
+            if found:
+                return min(found)
+            frontier = nxt
+        return None
 
-    def get_grid(self, pos: Pos) -> str:
-        return self.grid[pos.y, pos.x]
+    def reset(self):
+        """Fresh units from the snapshot: occ maps each cell index to the
+        unit standing there (or None), order holds the units in reading
+        order and alive counts the live units of each type."""
+        self.occ = [None] * (self.nrow * self.ncol)
+        self.order = []
+        self.alive = [0, 0]
+        for pos, typ, hp, ap in self.snapshot:
+            unit = Unit(typ, hp, ap, self.index(pos))
+            self.occ[unit.idx] = unit
+            self.order.append(unit)
+            self.alive[typ] += 1
+        self.order.sort(key=attrgetter("idx"))
+
+    @property
+    def units(self) -> Dict[Pos, Unit]:
+        return {self.pos(u.idx): u for u in self.order if u.hp > 0}
 
     def print_grid(self, dists: Dict[Pos, int]=dict()):
         for j in range(self.nrow):
@@ -87,145 +156,82 @@ class Map:
             for i in range(self.ncol):
                 p = Pos(i,j)
                 c = self.grid[j,i]
-                if p in self.units:
-                    c = self.units[p].as_char()
-                    u.append(self.units[p].as_hp())
+                unit = self.occ[j*self.ncol+i]
+                if unit is not None:
+                    c = unit.as_char()
+                    u.append(unit.as_hp())
                 elif p in dists:
                     c = str(dists[p])
                 print(c, end="")
             print("  ", end="")
             print(", ".join(u))
 
-    def neighbors(self, pos: Pos) -> Set[Pos]:
-        """Find all neighboring positions of pos that are not rock
-        (does not check for the presence of other units)."""
-        out = set()
-        for dx, dy in [(0, -1), (-1, 0), (1, 0), (0, 1)]:
-            nx = pos.x + dx
-            ny = pos.y + dy
-            if nx < 0 or nx > self.ncol or ny < 0 or ny > self.nrow:
-                continue
-            npos = Pos(pos.x+dx, pos.y+dy)
-            if self.get_grid(npos) == "#":
-                continue
-            out.add(npos)
-        return out
-
-    def dists(self, start: Pos) -> Dict[Pos, int]:
-        """Using BFS, calculate distances to all accessible nodes"""
-        dists = {start: 0}
-        nodes = deque()
-        nodes.append(start)
-        while nodes:
-            node = nodes.popleft()
-            for neighbor in self.neighbors(node):
-                if neighbor in self.units:
-                    continue
-                if neighbor not in dists:
-                    dists[neighbor] = dists[node]+1
-                    nodes.append(neighbor)
-        return dists
-
-    def length_of_shortest_path(self, start: Pos, goal: Pos) -> int:
-        """Using BFS, calculate shortest distance from start to end"""
-        if start == goal:
-            return 0
-        dists = {start: 0}
-        nodes = deque()
-        nodes.append(start)
-        while nodes:
-            node = nodes.popleft()
-            for neighbor in self.neighbors(node):
-                if neighbor == goal:
-                    return dists[node]+1
-                if neighbor in self.units:
-                    continue
-                if neighbor not in dists:
-                    dists[neighbor] = dists[node]+1
-                    nodes.append(neighbor)
-
-    def get_first_step(self, start: Pos, goal: Pos) -> Pos:
-        """For each first step from start, which is the best choice?"""
-
-        # find length of shortest path from each first step to goal
-        dist_from_first_step = defaultdict(list)
-        for neighbor in self.neighbors(start):
-            if neighbor not in self.units:
-                d = self.length_of_shortest_path(neighbor, goal)
-                if d is not None:
-                    dist_from_first_step[d].append(neighbor)
-
-        # for the first steps with the shortest paths, pick the best first
-        # step, using reading order to break ties
-        if dist_from_first_step:
-            dmin = min(dist_from_first_step.keys())
-            return sorted(dist_from_first_step[dmin], key=lambda p: (p.y, p.x)).pop(0)
-        else:
-            return None
-
     def move(self, start: Pos, unit: Unit) -> Tuple[Pos, str]:
+        occ = self.occ
+        nbrs = self.nbrs
+        s = unit.idx
+
         # check if already in attack range
-        for n in self.neighbors(start):
-            if n in self.units and self.units[n].type != unit.type:
+        for n in nbrs[s]:
+            other = occ[n]
+            if other is not None and other.type != unit.type:
                 return (start, "already in attack range")
 
-        # find possible in-range attack locations to travel to
-        inrange = set()
-        for epos, enemy in self.units.items():
-            if enemy.type == unit.type:
-                continue
-            for p in self.neighbors(epos):
-                if p not in self.units:
-                    inrange.add(p)
-        #print("inrange: %s" % (inrange,))
-
-        # find accessible attack locations and the distances to each
-        dists = self.dists(start)
-        inrange_dists = defaultdict(list)
-        for p in inrange:
-            if p in dists:
-                d = dists[p]
-                inrange_dists[d].append(p)
-        #print("  inrange_dists: %s" % (inrange_dists,))
-
-        # if there are accessible attack locations
-        if inrange_dists:
-            # pick the closest accessible attack location (ties broken by reading order)
-            min_dist = min(inrange_dists.keys())
-            dest = sorted(inrange_dists[min_dist], key=lambda p: (p.y, p.x)).pop(0)
-            #print("  dest: %s" % (dest,))
-
-            first_step = self.get_first_step(start, dest)
-            if first_step is None:
-                return (start, "no valid move?")
-            #print("  first step: %s" % (first_step,))
-
-            # actually do move
-            self.units[first_step] = unit
-            del self.units[start]
-            return (first_step, "moved %s -> %s" % (start, first_step))
-        else:
+        # mark free in-range attack locations
+        self.gen += 1
+        gen = self.gen
+        is_target = self.is_target
+        for enemy in self.order:
+            if enemy.hp > 0 and enemy.type != unit.type:
+                for n in nbrs[enemy.idx]:
+                    if occ[n] is None:
+                        is_target[n] = gen
+
+        # nearest reachable attack location (ties broken by reading order)
+        dest = self._bfs_nearest(s, is_target)
+        if dest is None:
             return (start, "no valid move")
 
+        # search back from the destination to the nearest first step
+        # (ties broken by reading order)
+        self.gen += 1
+        gen = self.gen
+        for n in nbrs[s]:
+            if occ[n] is None:
+                is_target[n] = gen
+        if is_target[dest] == gen:
+            step = dest
+        else:
+            step = self._bfs_nearest(dest, is_target)
+        if step is None:
+            return (start, "no valid move?")
+        first_step = self.pos(step)
+
+        # actually do move
+        occ[s] = None
+        occ[step] = unit
+        unit.idx = step
+        return (first_step, "moved %s -> %s" % (start, first_step))
+
     def attack(self, pos: Pos, unit: Unit, elf_ap=3) -> str:
-        # find all adjacent enemies and sort by hp
-        enemies = defaultdict(list)
-        for npos in self.neighbors(pos):
-            if npos in self.units and self.units[npos].type != unit.type:
-                enemies[self.units[npos].hp].append(npos)
-        if not enemies:
+        # pick the adjacent enemy with the lowest hp; neighbours come in
+        # reading order, so the first one found wins ties
+        occ = self.occ
+        target = None
+        for n in self.nbrs[unit.idx]:
+            other = occ[n]
+            if other is not None and other.type != unit.type:
+                if target is None or other.hp < target.hp:
+                    target = other
+        if target is None:
             return "no valid targets in attack range"
 
-        # pick the target with the lowest hp, breaking ties in reading order
-        min_hp = min(enemies.keys())
-        tpos = sorted(enemies[min_hp], key=lambda p: (p.y, p.x)).pop(0)
-        target = self.units[tpos]
-
         # attack that target
-        status = "attacking target at %s" % (tpos,)
+        status = "attacking target at %s" % (self.pos(target.idx),)
         target.hp -= unit.ap
         if target.hp <= 0:
-            del self.units[tpos]
+            occ[target.idx] = None
+            self.alive[target.type] -= 1
             status = status + " (unit killed)"
             if elf_ap > 3 and target.type == Unit.ELF:
                 raise MapException("elf was killed")
@@ -234,7 +240,7 @@ class Map:
     def run(self, n: int=None, debug: int=0, sleep: float=0.0, elf_ap=3) -> EndState:
         self.reset()
         if elf_ap > 3:
-            for u in self.units.values():
+            for u in self.order:
                 if u.type == Unit.ELF:
                     u.ap = elf_ap
         steps = 0
@@ -246,18 +252,21 @@ class Map:
                 if debug:
                     print()
                     print("-- step %d --" % (steps + 1,))
-                for pos in sorted(self.units.keys(), key=lambda p: (p.y, p.x)):
-                    if pos in self.units: # could have been killed by a prior attack step
-                        unit = self.units[pos]
-                        enemies = sum([1 for u in self.units.values() if u.type != unit.type])
-                        if not enemies:
+                for unit in self.order:
+                    if unit.hp > 0: # could have been killed by a prior attack step
+                        if not self.alive[1 - unit.type]:
                             raise MapException("all enemies killed")
+                        pos = self.pos(unit.idx)
                         npos, mstatus = self.move(pos, unit)
                         astatus = self.attack(npos, unit, elf_ap=elf_ap)
                         if debug >= 2: print("%s %s: move=%s, attack=%s" % (pos, unit, mstatus, astatus))
                         pass
                     else:
                         if debug >= 2: print("%s: unit was killed" % (unit,))
+                # units only move one square per round, so the surviving
+                # order is nearly sorted and the re-sort is close to linear
+                self.order = [u for u in self.order if u.hp > 0]
+                self.order.sort(key=attrgetter("idx"))
 
                 if debug:
                     self.print_grid()
@@ -266,66 +275,112 @@ class Map:
         except MapException as e:
             status = e.args[0]
 
-        remaining_hp = sum(u.hp for u in self.units.values())
+        remaining_hp = sum(u.hp for u in self.order if u.hp > 0)
         outcome = steps * remaining_hp
-        n_goblins = sum(1 for u in self.units.values() if unit.type == Unit.GOBLIN)
-        n_elves   = sum(1 for u in self.units.values() if unit.type == Unit.ELF)
+        n_goblins = self.alive[Unit.GOBLIN]
+        n_elves   = self.alive[Unit.ELF]
         return EndState(steps, remaining_hp, outcome, n_goblins, n_elves, status)
 
-    def find_lowest_elf_ap(self, debug=0):
-        elf_ap = 4
-        status = ""
-        state = None
-        while status != "all enemies killed":
-            state = self.run(debug=0, elf_ap=elf_ap)
-            if debug:
-                print("%4d %s" % (elf_ap, state))
-            elf_ap += 1
-            status = state.status
+    def find_lowest_elf_ap(self, debug=0, workers=1):
+        """Lowest elf attack power with which the elves win without a loss,
+        assuming more attack power never costs an elf.  Tries 4, 5, 7, 11,
+        19, ... until the elves win, then bisects between the highest losing
+        and lowest winning power.  With workers > 1 each round tries that
+        many powers at once in a process pool (the next doubling probes,
+        then evenly spaced points of the interval)."""
+        results = {}
+        pool = ProcessPoolExecutor(workers) if workers > 1 else None
+        last_run = None  # power of the last battle fought in self
+
+        def probe(aps):
+            nonlocal last_run
+            aps = sorted(set(ap for ap in aps if ap not in results))
+            if pool is not None:
+                states = pool.map(_battle, [(self.filename, ap) for ap in aps])
+            else:
+                states = (self.run(elf_ap=ap) for ap in aps)
+            for ap, state in zip(aps, states):
+                results[ap] = state
+                if pool is None:
+                    last_run = ap
+                if debug:
+                    print("%4d %s" % (ap, state))
+            won = [ap for ap in aps if results[ap].status == "all enemies killed"]
+            lost = [ap for ap in aps if ap not in won]
+            return won, lost
+
+        try:
+            lo, hi = 3, None
+            k = 0
+            while hi is None:
+                won, lost = probe([3 + (1 << i) for i in range(k, k + workers)])
+                k += workers
+                if won:
+                    hi = min(won)
+                lo = max([lo] + [ap for ap in lost if hi is None or ap < hi])
+            while hi - lo > 1:
+                n = min(workers, hi - lo - 1)
+                won, lost = probe([lo + (hi - lo) * (i + 1) // (n + 1) for i in range(n)])
+                hi = min([hi] + won)
+                lo = max([lo] + [ap for ap in lost if ap < hi])
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        # the pool leaves self.units untouched, and bisection may have
+        # ended on a losing battle, so replay the winner for the grid
+        if last_run != hi:
+            self.run(elf_ap=hi)
         self.print_grid()
-        return state
-
-print("== test1: basic movement ==")
-t1 = Map("test1.txt")
-print(t1.units)
-t1.print_grid()
-print(t1.run(n=2, debug=2))
-
-print()
-print("== test2: more movement ==")
-t2 = Map("test2.txt")
-t2.print_grid()
-print(t2.run(n=4, debug=2))
-
-print()
-print("== test3: full example ==")
-t3 = Map("test3.txt")
-print(t3.run(debug=0))
-
-full = ["test4", "test5", "test6", "test7", "test8"]
-for f in full:
+        return results[hi]
+
+def _battle(args):
+    """Pool worker: outcome of the battle on a map file at an elf attack power."""
+    filename, elf_ap = args
+    return Map(filename).run(elf_ap=elf_ap)
+
+if __name__ == "__main__":
+    print("== test1: basic movement ==")
+    t1 = Map("test1.txt")
+    print(t1.units)
+    t1.print_grid()
+    print(t1.run(n=2, debug=2))
+
+    print()
+    print("== test2: more movement ==")
+    t2 = Map("test2.txt")
+    t2.print_grid()
+    print(t2.run(n=4, debug=2))
+
     print()
-    print("== %s ==" % (f,))
-    t = Map(f+".txt")
-    t.print_grid()
-    print(t.run())
-    t.print_grid()
-
-print()
-print("== input ==")
-inp = Map("input.txt")
-inp.print_grid()
-print(inp.run(debug=0, sleep=0.0))
-inp.print_grid()
-
-full = ["test3", "test4", "test5", "test6", "test7", "test8"]
-for f in full:
+    print("== test3: full example ==")
+    t3 = Map("test3.txt")
+    print(t3.run(debug=0))
+
+    full = ["test4", "test5", "test6", "test7", "test8"]
+    for f in full:
+        print()
+        print("== %s ==" % (f,))
+        t = Map(f+".txt")
+        t.print_grid()
+        print(t.run())
+        t.print_grid()
+
+    print()
+    print("== input ==")
+    inp = Map("input.txt")
+    inp.print_grid()
+    print(inp.run(debug=0, sleep=0.0))
+    inp.print_grid()
+
+    full = ["test3", "test4", "test5", "test6", "test7", "test8"]
+    for f in full:
+        print()
+        print("== part #2, %s ==" % (f,))
+        t = Map(f+".txt")
+        t.print_grid()
+        t.find_lowest_elf_ap(debug=1)
+
     print()
-    print("== part #2, %s ==" % (f,))
-    t = Map(f+".txt")
-    t.print_grid()
-    t.find_lowest_elf_ap(debug=1)
-
-print()
-print("== part #2, input ==")
-inp.find_lowest_elf_ap(debug=1)
+    print("== part #2, input ==")
+    inp.find_lowest_elf_ap(debug=1, workers=os.cpu_count())
@@ -1,139 +1,163 @@
 # -*- coding: utf-8 -*-
 
-import re
+from array import array
+from collections import deque
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+import elfcode
 
 class Program:
-    instr = {
-        "addr": lambda reg, a, b : reg[a] + reg[b],
-        "addi": lambda reg, a, b : reg[a] + b,
-        "mulr": lambda reg, a, b : reg[a] * reg[b],
-        "muli": lambda reg, a, b : reg[a] * b,
-        "banr": lambda reg, a, b : reg[a] & reg[b],
-        "bani": lambda reg, a, b : reg[a] & b,
-        "borr": lambda reg, a, b : reg[a] | reg[b],
-        "bori": lambda reg, a, b : reg[a] | b,
-        "setr": lambda reg, a, b : reg[a],
-        "seti": lambda reg, a, b : a,
-        "gtir": lambda reg, a, b : 1 if a > reg[b] else 0,
-        "gtri": lambda reg, a, b : 1 if reg[a] > b else 0,
-        "gtrr": lambda reg, a, b : 1 if reg[a] > reg[b] else 0,
-        "eqir": lambda reg, a, b : 1 if a == reg[b] else 0,
-        "eqri": lambda reg, a, b : 1 if reg[a] == b else 0,
-        "eqrr": lambda reg, a, b : 1 if reg[a] == reg[b] else 0
-    }
-    patt_reg = re.compile(r"""(.*):\s+\[(.*)\]""")
-    
     def __init__(self, filename):
         self.parsetest(filename)
         self.reduce_opcode_map()
     
+    # numpy versions of each opcode, over arrays of register values ra/rb
+    # and immediates a/b
+    vinstr = {
+        "addr": lambda ra, rb, a, b : ra + rb,
+        "addi": lambda ra, rb, a, b : ra + b,
+        "mulr": lambda ra, rb, a, b : ra * rb,
+        "muli": lambda ra, rb, a, b : ra * b,
+        "banr": lambda ra, rb, a, b : ra & rb,
+        "bani": lambda ra, rb, a, b : ra & b,
+        "borr": lambda ra, rb, a, b : ra | rb,
+        "bori": lambda ra, rb, a, b : ra | b,
+        "setr": lambda ra, rb, a, b : ra,
+        "seti": lambda ra, rb, a, b : a,
+        "gtir": lambda ra, rb, a, b : (a > rb).astype(int),
+        "gtri": lambda ra, rb, a, b : (ra > b).astype(int),
+        "gtrr": lambda ra, rb, a, b : (ra > rb).astype(int),
+        "eqir": lambda ra, rb, a, b : (a == rb).astype(int),
+        "eqri": lambda ra, rb, a, b : (ra == b).astype(int),
+        "eqrr": lambda ra, rb, a, b : (ra == rb).astype(int)
+    }
+    
     @staticmethod
-    def evaluate(op, reg, a, b, c):
-        reg[c] = Program.instr[op](reg, a, b)
+    def match_all(breg, ops, areg):
+        """For arrays of samples (one row each), return a (16, nsamples)
+        boolean array of which ops (in elfcode.OPNAMES order) turn breg
+        into areg."""
+        nreg = breg.shape[1]
+        rows = np.arange(len(ops))
+        a, b, c = ops[:,1], ops[:,2], ops[:,3]
+        a_ok, b_ok, c_ok = a < nreg, b < nreg, c < nreg
+        ra = breg[rows, np.where(a_ok, a, 0)]
+        rb = breg[rows, np.where(b_ok, b, 0)]
+        cc = np.where(c_ok, c, 0)
+        expect = areg[rows, cc]
+        # every register other than c must be unchanged
+        same = ((breg == areg) | (np.arange(nreg) == cc[:,None])).all(axis=1) & c_ok
+        out = np.zeros((len(elfcode.OPNAMES), len(ops)), dtype=bool)
+        for k, name in enumerate(elfcode.OPNAMES):
+            valid = same.copy()
+            if "{ra}" in elfcode.EXPRS[k]:
+                valid &= a_ok
+            if "{rb}" in elfcode.EXPRS[k]:
+                valid &= b_ok
+            out[k] = valid & (Program.vinstr[name](ra, rb, a, b) == expect)
+        return out
     
     @staticmethod
-    def count_all(breg, op, areg):
-        count=0
-        ops=[]
-        opcode, a, b, c=op
-        #print(opcode, a, b, c)
-        #print("%2d: " % (opcode,), end="")
-        for op in Program.instr:
-            r=breg[:]
-            Program.evaluate(op, r, a, b, c)
-            if r == areg:
-                #print(" %s" % (op,), end="")
-                ops.append(op)
-                count+=1
-        #print()
-        return ops
+    def candidate_masks(opnums, matches):
+        """16-bit mask per opcode number of the ops consistent with every
+        sample using that number (all bits set for numbers not seen)."""
+        masks = np.full(16, 0xFFFF, dtype=int)
+        for k in range(len(elfcode.OPNAMES)):
+            fails = np.bincount(opnums[~matches[k]], minlength=16)
+            masks &= np.where(fails == 0, 0xFFFF, 0xFFFF & ~(1 << k))
+        return masks
     
     @staticmethod
-    def get_reg(expname, s):
-        m=Program.patt_reg.match(s)
-        if m:
-            name=m.group(1)
-            if expname == name:
-                return [int(n) for n in m.group(2).split(", ")]
-            return None
-        else:
-            return None
-        
+    def get_reg(s):
+        return map(int, s[s.index("[")+1:s.index("]")].split(","))
+    
     @staticmethod
-    def get_op(s):
-        out=[int(n) for n in s.split(" ")]
-        return out
+    def read_samples(fh, chunk=65536):
+        """Read samples four lines at a time, yielding (before, op, after)
+        array('i') buffers of up to chunk samples each.  Stops after the
+        first line that is not a "Before:" line, leaving fh at the
+        program."""
+        breg, ops, areg = array("i"), array("i"), array("i")
+        while True:
+            line = fh.readline()
+            if not line.startswith("Before"):
+                break
+            breg.extend(Program.get_reg(line))
+            ops.extend(map(int, fh.readline().split()))
+            areg.extend(Program.get_reg(fh.readline()))
+            fh.readline()
+            if len(ops) >= 4 * chunk:
+                yield breg, ops, areg
+                breg, ops, areg = array("i"), array("i"), array("i")
+        if ops:
+            yield breg, ops, areg
+    
+    @staticmethod
+    def read_program(fh):
+        code = array("i")
+        for line in fh:
+            code.extend(map(int, line.split()))
+        return code
     
     def parsetest(self, filename):
-        self.count=0
-        self.opcode_map={}
-        state="examples"
+        self.count = 0
+        self.masks = np.full(16, 0xFFFF, dtype=int)
+        seen = np.zeros(16, dtype=bool)
         with open(filename, 'r') as fh:
-            lines=[]
-            for line in fh:
-                lines.append(line.rstrip())
-                if state == "examples":
-                    if len(lines) == 4:
-                        breg=Program.get_reg("Before", lines[0])
-                        if breg == None:
-                            state="ops"
-                            lines.remove("")
-                            lines.remove("")
-                        else:
-                            op=Program.get_op(lines[1])
-                            areg=Program.get_reg("After", lines[2])
-                            ops=Program.count_all(breg, op, areg)
-                        
-                            if len(ops) >= 3:
-                                self.count+=1
-                            opcode = op[0]
-                            if opcode not in self.opcode_map:
-                                self.opcode_map[opcode]=set(ops)
-                            self.opcode_map[opcode] = self.opcode_map[opcode].intersection(ops)
-                                #print(breg, op, areg)
-                            lines=[]
-                elif state == "ops":
-                    pass
-        self.code=[]
-        for l in lines:
-            self.code.append([int(n) for n in l.split(" ")])
+            for breg, ops, areg in Program.read_samples(fh):
+                ops = np.frombuffer(ops, dtype=np.int32).reshape(-1, 4)
+                matches = Program.match_all(
+                        np.frombuffer(breg, dtype=np.int32).reshape(-1, 4), ops,
+                        np.frombuffer(areg, dtype=np.int32).reshape(-1, 4))
+                self.count += int((matches.sum(axis=0) >= 3).sum())
+                self.masks &= Program.candidate_masks(ops[:,0], matches)
+                seen |= np.bincount(ops[:,0], minlength=16) > 0
+            self.code = Program.read_program(fh)
+        self.masks[~seen] = 0
         print("opcodes with >= 3 ops: %d" % (self.count,))
         return self.count
     
     def reduce_opcode_map(self):
-        mult = set()
-        sing = set()
-        for k, v in self.opcode_map.items():
-            if len(v) > 1:
-                mult.add(k)
-            else:
-                sing.add(k)
+        """Unit propagation: once a number has a single candidate op, remove
+        that op from every other number, queueing any that become single."""
+        masks = [int(m) for m in self.masks]
+        queue = deque(n for n, m in enumerate(masks) if m and m & (m - 1) == 0)
+        done = set()
+        while queue:
+            n = queue.popleft()
+            if n in done:
+                continue
+            done.add(n)
+            bit = masks[n]
+            for o, m in enumerate(masks):
+                if o != n and m & bit:
+                    masks[o] = m & ~bit
+                    if masks[o] & (masks[o] - 1) == 0:
+                        queue.append(o)
         
-        while len(mult) > 0:
-            for s in sing:
-                op = self.opcode_map[s]
-                for m in mult:
-                    self.opcode_map[m] -= op
-            #print(p.opcode_map)
-            mult = set()
-            sing = set()
-            for k, v in self.opcode_map.items():
-                if len(v) > 1:
-                    mult.add(k)
-                else:
-                    sing.add(k)
-                    
         self.n_to_opcode = {}
-        for k, v in self.opcode_map.items():
-            self.n_to_opcode[k] = v.pop()
+        for n, m in enumerate(masks):
+            if m == 0:
+                continue
+            if m & (m - 1):
+                raise Exception("opcode %d is ambiguous" % (n,))
+            self.n_to_opcode[n] = elfcode.OPNAMES[m.bit_length() - 1]
    
     def run(self):
-        reg = [0, 0, 0, 0]
-        for codeline in self.code:
-            n, a, b, c = codeline
-            opcode = self.n_to_opcode[n]
-            Program.evaluate(opcode, reg, a, b, c)
-            print("%4s %d %d %d => %s" % (opcode, a, b, c, reg))
+        code = self.code
+        instructions = [[self.n_to_opcode[code[i]], code[i+1], code[i+2], code[i+3]]
+                        for i in range(0, len(code), 4)]
+        vm = elfcode.Program(instructions=instructions, nreg=4)
+        ip = 0
+        while 0 <= ip < len(instructions):
+            opcode, a, b, c = instructions[ip]
+            ip = vm.plain_funcs[ip](vm.reg)
+            print("%4s %d %d %d => %s" % (opcode, a, b, c, vm.reg))
+        return vm.reg
         
 p = Program("input.txt")
 
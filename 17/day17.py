@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 
 import re
+import sys
 
-import matplotlib.pyplot as plt
 import numpy as np
 
 class Vein:
@@ -60,6 +60,7 @@ class Ground:
         self.width  = self.xmax - self.xmin + 1
         self.height = self.ymax - self.ymin + 1
         self.grid = self._build_grid()
+        self.stack = []
     
     def _read_veins(self, filename):
         veins = []
@@ -113,30 +114,69 @@ class Ground:
             lines.append("".join(line))
         return "\n".join(lines)
     
-    def flow(self, x, y, d):
-        if x < 0 or x >= self.width:
-            return None
-        if self.grid[y,x] == self.EMPTY:
-            self.grid[y,x] = self.FLOWING
-        if y == self.height-1:
-            return None
-        if self.grid[y,x] == self.CLAY:
-            return x
-        
-        if self.grid[y+1,x] == self.EMPTY:
-            self.flow(x, y+1, 0)
-        
-        if self.grid[y+1,x] == self.SETTLED or self.grid[y+1,x] == self.CLAY:
-            if d:
-                return self.flow(x+d, y, d)
-            else:
-                leftx  = self.flow(x-1, y, -1)
-                rightx = self.flow(x+1, y,  1)
-                if self.grid[y,leftx] == self.CLAY and self.grid[y,rightx] == self.CLAY:
-                    self.grid[y,leftx+1:rightx] = self.SETTLED
-        else:
-            return x
-            
+    def flow(self, x, y, max_steps=None):
+        """Pour water in at column x, row y.  Returns True once the water
+        has come to rest, or False after max_steps steps, in which case
+        resume() carries on from where it stopped."""
+        self.stack = [(x, y)]
+        return self.resume(max_steps)
+
+    def resume(self, max_steps=None):
+        """Work through the stack of falling streams.  A step takes the
+        stream on top, drops it to the first clay or settled water below
+        and spreads it along that row up to the walls on either side,
+        both found with argmax over a row slice.  A span closed by two
+        walls settles and the stream is stepped again to fill the next
+        row up, until its starting cell settles.  Otherwise new streams
+        fall from the open ends, and the stream stays on the stack until
+        they are done in case they fill up to its row.  A stream that
+        opens no new streams is done."""
+        grid = self.grid
+        steps = 0
+        while self.stack:
+            if max_steps is not None and steps >= max_steps:
+                return False
+            steps += 1
+            x, y = self.stack[-1]
+            if grid[y,x] == self.SETTLED or grid[y,x] == self.CLAY:
+                # filled up to where it started (or poured onto clay):
+                # back to the stream above
+                self.stack.pop()
+                continue
+
+            # fall
+            below = grid[y+1:,x]
+            stop = (below == self.CLAY) | (below == self.SETTLED)
+            if not stop.any():
+                grid[y:,x] = self.FLOWING
+                self.stack.pop()
+                continue
+            r = y + int(stop.argmax())
+            grid[y:r+1,x] = self.FLOWING
+
+            # spread along row r, over a floor of clay or settled water
+            row = grid[r]
+            floor = grid[r+1]
+            open_floor = (floor != self.CLAY) & (floor != self.SETTLED)
+            left = int(((row[x::-1] == self.CLAY) | open_floor[x::-1]).argmax())
+            right = int(((row[x:] == self.CLAY) | open_floor[x:]).argmax())
+            lo, hi = x - left, x + right
+            lwall = row[lo] == self.CLAY
+            rwall = row[hi] == self.CLAY
+            if lwall and rwall:
+                row[lo+1:hi] = self.SETTLED
+                continue
+            row[lo+(1 if lwall else 0):hi+(0 if rwall else 1)] = self.FLOWING
+
+            pushed = False
+            for edge, wall in (lo, lwall), (hi, rwall):
+                if not wall and floor[edge] == self.EMPTY:
+                    self.stack.append((edge, r))
+                    pushed = True
+            if not pushed:
+                self.stack.pop()
+        return True
+
     def count_water(self):
         flowing = (self.grid == self.FLOWING).sum()
         settled = (self.grid == self.SETTLED).sum()
@@ -144,6 +184,18 @@ class Ground:
     
     def count_settled(self):
         return (self.grid == self.SETTLED).sum()
+
+    def plot(self, figsize=(12,60)):
+        """Show the grid as an image.  matplotlib is only imported here,
+        so runs that just want the counts never load it."""
+        import matplotlib.pyplot as plt
+        fig = plt.figure(figsize=figsize)
+        ax = fig.add_subplot(111)
+        #ax.set_xlim([0,250])
+        #ax.set_ylim([500,0])
+        ax.imshow(self.grid)
+        fig.show()
+        return fig
         
 t = Ground("test.txt")
 
@@ -153,19 +205,15 @@ print(t.ymin, t.ymax)
 #print(t.grid)
 print(t.draw_grid())
 print()
-t.flow(500-t.xmin, 0, 0)
+t.flow(500-t.xmin, 0)
 print(t.draw_grid())
 print("all: %d" % (t.count_water(),))
 print("settled: %d" % (t.count_settled(),))
 
 inp = Ground("input.txt")
-inp.flow(500-inp.xmin, 0, 0)
+inp.flow(500-inp.xmin, 0)
 #print(inp.draw_grid())
-fig = plt.figure(figsize=(12,60))
-ax = fig.add_subplot(111)
-#ax.set_xlim([0,250])
-#ax.set_ylim([500,0])
-ax.imshow(inp.grid)
-fig.show()
+if "--plot" in sys.argv[1:]:
+    inp.plot()
 print("all: %d" % (inp.count_water(),))
 print("settled: %d" % (inp.count_settled(),))
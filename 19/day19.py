@@ -1,74 +1,29 @@
 # -*- coding: utf-8 -*-
 
-import re
+import os
+import sys
 
-class Program:
-    OPCODES = {
-        "addr": lambda reg, a, b : reg[a] + reg[b],
-        "addi": lambda reg, a, b : reg[a] + b,
-        "mulr": lambda reg, a, b : reg[a] * reg[b],
-        "muli": lambda reg, a, b : reg[a] * b,
-        "banr": lambda reg, a, b : reg[a] & reg[b],
-        "bani": lambda reg, a, b : reg[a] & b,
-        "borr": lambda reg, a, b : reg[a] | reg[b],
-        "bori": lambda reg, a, b : reg[a] | b,
-        "setr": lambda reg, a, b : reg[a],
-        "seti": lambda reg, a, b : a,
-        "gtir": lambda reg, a, b : 1 if a > reg[b] else 0,
-        "gtri": lambda reg, a, b : 1 if reg[a] > b else 0,
-        "gtrr": lambda reg, a, b : 1 if reg[a] > reg[b] else 0,
-        "eqir": lambda reg, a, b : 1 if a == reg[b] else 0,
-        "eqri": lambda reg, a, b : 1 if reg[a] == b else 0,
-        "eqrr": lambda reg, a, b : 1 if reg[a] == reg[b] else 0
-    }
-    
-    def __init__(self, filename):
-        self.filename = filename
-        self.ip, self.instructions = self._parse_file(filename)
-        self.instructions_size = len(self.instructions)
-        self._reset_reg()
-    
-    def _parse_file(self, filename):
-        ip=None
-        instr=[]
-        with open(filename, "r") as fh:
-            ip_line = fh.readline().rstrip()
-            m=re.match(r"""#ip (\d+)""", ip_line)
-            if m:
-                ip=int(m.group(1))
-            for line in fh:
-                l=line.rstrip().split(" ")
-                instr.append([l[0],int(l[1]),int(l[2]),int(l[3])])
-        return ip, instr
-    
-    def _reset_reg(self):
-        self.reg = [0, 0, 0, 0, 0, 0]
-       
-    def evaluate(self, op, a, b, c):
-        self.reg[c] = self.OPCODES[op](self.reg, a, b)
-        
-    def run(self, debug=0, r0=0):
-        i=0
-        self.reg[0]=r0
-        while(self.reg[self.ip] >= 0 and 
-              self.reg[self.ip] < self.instructions_size):
-            i+=1
-            if debug >= 1 and (i % 100000) == 0:
-                print("%10d %s" % (i, self.reg))
-            op, a, b, c = self.instructions[self.reg[self.ip]]
-            if debug >= 2:
-                print("ip=%d %s %s %d %d %d" % (self.reg[self.ip], self.reg, op, a, b, c), end="")
-            self.evaluate(op, a, b, c)
-            if debug >= 2:
-                print(" %s" % (self.reg,))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+import elfcode
 
-            self.reg[self.ip]+=1
-        print(self.reg)
-        
-t = Program("test.txt")
+def check_modes(prog, r0=0):
+    prog.run(r0=r0)
+    reg = prog.reg
+    prog.run(r0=r0, mode="blocks")
+    print("%s r0=%d: closures=%s blocks=%s (%s)" % (
+            prog.filename, r0, reg, prog.reg, reg == prog.reg))
+
+t = elfcode.Program("test.txt")
 print(t.ip)
 print(t.instructions)
 t.run()
+print(t.reg)
+check_modes(t)
 
-t2 = Program("input.txt")
-t2.run(debug=2, r0=1)
\ No newline at end of file
+t2 = elfcode.Program("input.txt")
+print("idioms: %s" % ({k: i["name"] for k, (i, b) in t2.idioms.items()},))
+check_modes(t2)
+if "--profile" in sys.argv[1:]:
+    t2.profile(r0=1, max_steps=1000000)
+t2.run(r0=1, mode="blocks")
+print("part 2: %s" % (t2.reg,))
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-import networkx
+from collections import defaultdict, deque
 
 class Point:
     def __init__(self, x, y):
@@ -51,9 +51,12 @@ class Maze:
     def __init__(self, regex):
         self.regex = regex
         self.maze = self._build_maze(self.regex)
+        self._lengths = None
         
     def _build_maze(self, regex):
-        maze = networkx.Graph()
+        """Rooms and the doors between them, as a dict mapping each room
+        to the set of rooms it has a door to."""
+        maze = defaultdict(set)
         
         pos = {Point(0, 0)}
         stack = []
@@ -61,8 +64,13 @@ class Maze:
        
         for c in regex[1:-1]:
             if c in 'NESW':
-                maze.add_edges_from((p, p.neighbor(c)) for p in pos)
-                pos = {p.neighbor(c) for p in pos}
+                nxt = set()
+                for p in pos:
+                    n = p.neighbor(c)
+                    maze[p].add(n)
+                    maze[n].add(p)
+                    nxt.add(n)
+                pos = nxt
             elif c == '(':
                 stack.append((starts, ends))
                 starts, ends = pos, set()
@@ -73,12 +81,27 @@ class Maze:
                 pos.update(ends)
                 starts, ends = stack.pop()
                 
-        return maze
+        return dict(maze)
+
+    def shortest_path_lengths(self):
+        """Doors to pass through to reach each room from the start (BFS)."""
+        if self._lengths is None:
+            start = Point(0, 0)
+            lengths = {start: 0}
+            queue = deque([start])
+            while queue:
+                p = queue.popleft()
+                for n in self.maze.get(p, ()):
+                    if n not in lengths:
+                        lengths[n] = lengths[p] + 1
+                        queue.append(n)
+            self._lengths = lengths
+        return self._lengths
     
     def pprint(self):
         xmin, xmax = 0, 0
         ymin, ymax = 0, 0
-        for n in self.maze.nodes():
+        for n in self.maze:
             if n.x < xmin: xmin = n.x
             if n.x > xmax: xmax = n.x
             if n.y < ymin: ymin = n.y
@@ -96,7 +119,7 @@ class Maze:
                     print("X", end="")
                 else:
                     print(".", end="")
-                if p.neighbor('E') in self.maze.adj[p]:
+                if p.neighbor('E') in self.maze.get(p, ()):
                     print("|", end="")
                 else:
                     print("#", end="")
@@ -104,7 +127,7 @@ class Maze:
             print("#", end="")
             for x in range(xmin, xmax+1):
                 p = Point(x, y)
-                if p.neighbor('S') in self.maze.adj[p]:
+                if p.neighbor('S') in self.maze.get(p, ()):
                     print("-", end="")
                 else:
                     print("#", end="")
@@ -112,11 +135,11 @@ class Maze:
             print()
     
     def furthest(self):
-        lengths = networkx.algorithms.shortest_path_length(self.maze, Point(0, 0))
+        lengths = self.shortest_path_lengths()
         return max(lengths.values())
     
     def count_longer_than(self, n=1000):
-        lengths = networkx.algorithms.shortest_path_length(self.maze, Point(0, 0))
+        lengths = self.shortest_path_lengths()
         return sum([1 for x in lengths.values() if x >= n])
     
 t1 = Maze("^WNE$")
@@ -4,7 +4,6 @@ from collections import namedtuple
 import re
 
 import numpy as np
-import networkx
 
 BoundingBox = namedtuple("BoundingBox", ["xmin", "xmax", "ymin", "ymax", "zmin", "zmax"])
 
@@ -56,7 +55,7 @@ class Graph:
         self.filename = filename
         self.nodes = self._parsefile()
         self.dists = self._calc_dists()
-        self.graph = self._build_graph()
+        self._graph = None
         self.bx = np.fromiter((b.x for b in self.nodes), dtype=int)
         self.by = np.fromiter((b.y for b in self.nodes), dtype=int)
         self.bz = np.fromiter((b.z for b in self.nodes), dtype=int)
@@ -79,7 +78,16 @@ class Graph:
                 dists[(i,j)] = self.nodes[i].dist(self.nodes[j])
         return dists
     
+    @property
+    def graph(self):
+        """Graph with an edge i -> j for each bot j in range of bot i, built
+        on first use (networkx is only imported then)."""
+        if self._graph is None:
+            self._graph = self._build_graph()
+        return self._graph
+
     def _build_graph(self):
+        import networkx
         graph = networkx.MultiDiGraph()
         for i in range(len(self.nodes)):
             graph.add_node(i)
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 
 from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def play(turns=25, nplayers=9, verbose=False):
+def play_deque(turns=25, nplayers=9, verbose=False):
     c=deque()
     c.append(0)
 
@@ -24,20 +25,86 @@ def play(turns=25, nplayers=9, verbose=False):
     
     return max(scores.values())
 
-print(play(turns=25, nplayers=9, verbose=True))
+def play_array(turns=25, nplayers=9, verbose=False):
+    """Same game on a circular doubly linked list held in preallocated
+    next/prev lists indexed by marble, with scores in a flat list indexed
+    by player, so no allocation happens per marble."""
+    nxt = [0] * (turns+1)
+    prv = [0] * (turns+1)
+    scores = [0] * (nplayers+1)
+    cur = 0
+    p = 0
+    for n in range(1, turns+1):
+        p = p % nplayers + 1
+        if n % 23 == 0:
+            r = prv[prv[prv[prv[prv[prv[prv[cur]]]]]]]
+            scores[p] += n + r
+            a = prv[r]
+            b = nxt[r]
+            nxt[a] = b
+            prv[b] = a
+            cur = b
+        else:
+            a = nxt[cur]
+            b = nxt[a]
+            nxt[a] = n
+            prv[n] = a
+            nxt[n] = b
+            prv[b] = n
+            cur = n
+        if verbose:
+            c = [cur]
+            m = nxt[cur]
+            while m != cur:
+                c.append(m)
+                m = nxt[m]
+            print("%d %s" % (p, c))
+    
+    return max(scores)
 
-tests=[
- (10, 1618, 8317),
- (13, 7999, 146373),
- (17, 1104, 2764),
- (21, 6111, 54718),
- (30, 5807, 37305)
-]
+ENGINES = {"deque": play_deque, "array": play_array}
 
-for p, t, expect in tests:
-    calc = play(turns=t, nplayers=p)
-    print("p=%d t=%d expect=%d calc=%d" % (p, t, expect, calc))
-    
-print("Part 1 : %d" % (play(turns=71700, nplayers=405),))
+def play(turns=25, nplayers=9, verbose=False, engine="array"):
+    return ENGINES[engine](turns=turns, nplayers=nplayers, verbose=verbose)
+
+def _play_game(job):
+    nplayers, turns, engine = job
+    return ENGINES[engine](turns=turns, nplayers=nplayers)
+
+def _stream_games(jobs, workers):
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(_play_game, job): i for i, job in enumerate(jobs)}
+        for f in as_completed(futures):
+            yield futures[f], f.result()
+
+def play_many(games, workers=None, engine="array", stream=False):
+    """High scores for a list of (nplayers, turns) games, played in a pool
+    of worker processes with verbose output off.  Returns the scores in
+    input order, or with stream=True a generator of (index, score) pairs
+    in the order the games finish."""
+    jobs = [(p, t, engine) for p, t in games]
+    if stream:
+        return _stream_games(jobs, workers)
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(_play_game, jobs))
+
+if __name__ == "__main__":
+    print(play(turns=25, nplayers=9, verbose=True, engine="deque"))
+    print(play(turns=25, nplayers=9, verbose=True))
+
+    tests=[
+     (10, 1618, 8317),
+     (13, 7999, 146373),
+     (17, 1104, 2764),
+     (21, 6111, 54718),
+     (30, 5807, 37305)
+    ]
+
+    for engine in ENGINES:
+        scores = play_many([(p, t) for p, t, expect in tests], engine=engine)
+        for (p, t, expect), calc in zip(tests, scores):
+            print("%s p=%d t=%d expect=%d calc=%d (%s)" % (engine, p, t, expect, calc, expect == calc))
+
+    print("Part 1 : %d" % (play(turns=71700, nplayers=405),))
 
-print("Part 2 : %d" % (play(turns=7170000, nplayers=405),))
\ No newline at end of file
+    print("Part 2 : %d" % (play(turns=7170000, nplayers=405),))
\ No newline at end of file
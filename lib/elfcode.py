@@ -0,0 +1,602 @@
+# -*- coding: utf-8 -*-
+"""Shared ElfCode virtual machine used by days 16, 19 and 21."""
+
+from array import array
+import re
+
+# opcode names; an opcode's number is its index here
+OPNAMES = [
+    "addr", "addi", "mulr", "muli", "banr", "bani", "borr", "bori",
+    "setr", "seti", "gtir", "gtri", "gtrr", "eqir", "eqri", "eqrr"
+]
+OPNUMS = {name: n for n, name in enumerate(OPNAMES)}
+
+# python expression for each opcode, in OPNAMES order, with A/B being
+# either a register reference or an immediate value
+EXPRS = [
+    "{ra} + {rb}",
+    "{ra} + {b}",
+    "{ra} * {rb}",
+    "{ra} * {b}",
+    "{ra} & {rb}",
+    "{ra} & {b}",
+    "{ra} | {rb}",
+    "{ra} | {b}",
+    "{ra}",
+    "{a}",
+    "1 if {a} > {rb} else 0",
+    "1 if {ra} > {b} else 0",
+    "1 if {ra} > {rb} else 0",
+    "1 if {a} == {rb} else 0",
+    "1 if {ra} == {b} else 0",
+    "1 if {ra} == {rb} else 0"
+]
+
+class Halt(Exception):
+    """Raised by a hook to stop the program early."""
+    pass
+
+def parse(filename):
+    """Read an ElfCode source file, returning the bound ip register (or None)
+    and the list of [op, a, b, c] instructions."""
+    ip = None
+    instr = []
+    with open(filename, "r") as fh:
+        for line in fh:
+            line = line.rstrip()
+            if not line:
+                continue
+            m = re.match(r"""#ip (\d+)""", line)
+            if m:
+                ip = int(m.group(1))
+                continue
+            l = line.split(" ")
+            instr.append([l[0], int(l[1]), int(l[2]), int(l[3])])
+    return ip, instr
+
+def decode(instructions):
+    """Convert [op, a, b, c] instructions into (opnum, a, b, c) tuples."""
+    return [(OPNUMS[op], a, b, c) for op, a, b, c in instructions]
+
+def expr(opnum, a, b, regfmt="r[%d]", consts={}):
+    """Python source for the value computed by a single instruction.  Reads
+    of registers listed in consts are replaced by their constant value."""
+    def operand(n):
+        return str(consts[n]) if n in consts else regfmt % (n,)
+    return EXPRS[opnum].format(a=a, b=b, ra=operand(a), rb=operand(b))
+
+def divisor_sum(n, start=1):
+    """Sum of the divisors of n that are >= start, in O(sqrt n)."""
+    total = 0
+    d = 1
+    while d * d <= n:
+        if n % d == 0:
+            if d >= start:
+                total += d
+            e = n // d
+            if e != d and e >= start:
+                total += e
+        d += 1
+    return total
+
+# Known loop shapes.  Each pattern is a list of instructions whose operands
+# are either register variables (upper case names, "IP" being the bound ip
+# register), immediate variables (lower case names), ip values relative to
+# the start of the pattern ("+n"/"-n"), literal integers, or "*" for ignored
+# operands.  guard and body are python source over the bound
+# registers; exit is the ip the program continues at, relative to the start
+# of the pattern.
+IDIOMS = [
+    {
+        # for A in A..N: for B in 1..N: if A*B == N: S += A
+        "name": "divisor_sum",
+        "pattern": [
+            ("seti", 1, "*", "B"),
+            ("mulr", "A", "B", "T"),
+            ("eqrr", "T", "N", "T"),
+            ("addr", "T", "IP", "IP"),
+            ("addi", "IP", 1, "IP"),
+            ("addr", "A", "S", "S"),
+            ("addi", "B", 1, "B"),
+            ("gtrr", "B", "N", "T"),
+            ("addr", "IP", "T", "IP"),
+            ("seti", "+0", "*", "IP"),
+            ("addi", "A", 1, "A"),
+            ("gtrr", "A", "N", "T"),
+            ("addr", "T", "IP", "IP"),
+            ("seti", "-1", "*", "IP")],
+        "guard": "1 <= {A} <= {N}",
+        "body": ["{S} += divisor_sum({N}, {A})",
+                 "{A} = {N} + 1",
+                 "{B} = {A}",
+                 "{T} = 1"],
+        "exit": 14
+    },
+    {
+        # C = 0; while (C + 1) * k <= D: C += 1
+        "name": "divide",
+        "pattern": [
+            ("seti", 0, "*", "C"),
+            ("addi", "C", 1, "B"),
+            ("muli", "B", "k", "B"),
+            ("gtrr", "B", "D", "B"),
+            ("addr", "B", "IP", "IP"),
+            ("addi", "IP", 1, "IP"),
+            ("seti", "+8", "*", "IP"),
+            ("addi", "C", 1, "C"),
+            ("seti", "+0", "*", "IP")],
+        "guard": "{k} > 0",
+        "body": ["{C} = max(0, {D} // {k})",
+                 "{B} = 1"],
+        "exit": 9
+    }
+]
+
+COMMUTATIVE = {"addr", "mulr", "banr", "borr", "eqrr"}
+
+def _match_operand(pat, val, start, binding):
+    if pat == "*":
+        return True
+    if isinstance(pat, int):
+        return pat == val
+    if pat[0] in "+-":
+        return start + int(pat) == val
+    if pat in binding:
+        return binding[pat] == val
+    if pat.islower():
+        binding[pat] = val
+        return True
+    if val in [v for n, v in binding.items() if n.isupper()]:
+        return False
+    binding[pat] = val
+    return True
+
+def _match_instruction(pat, instr, start, binding):
+    op, a, b, c = instr
+    if pat[0] != op:
+        return False
+    orders = [(pat[1], pat[2])]
+    if op in COMMUTATIVE:
+        orders.append((pat[2], pat[1]))
+    for pa, pb in orders:
+        trial = dict(binding)
+        if (_match_operand(pa, a, start, trial)
+                and _match_operand(pb, b, start, trial)
+                and _match_operand(pat[3], c, start, trial)):
+            binding.clear()
+            binding.update(trial)
+            return True
+    return False
+
+def find_idioms(instructions, ip):
+    """Find known loop shapes in a program, returning a dict of start ip to
+    (idiom, binding), binding mapping the pattern's names to registers and
+    immediates."""
+    found = {}
+    if ip is None:
+        return found
+    for start in range(len(instructions)):
+        for idiom in IDIOMS:
+            pattern = idiom["pattern"]
+            if start + len(pattern) > len(instructions):
+                continue
+            binding = {"IP": ip}
+            for k, pat in enumerate(pattern):
+                if not _match_instruction(pat, instructions[start + k], start, binding):
+                    break
+            else:
+                found[start] = (idiom, binding)
+    return found
+
+def idiom_source(idiom, binding, regfmt):
+    """Guard and body source for an idiom with its registers bound."""
+    names = {}
+    for name, val in binding.items():
+        names[name] = str(val) if name.islower() else regfmt % (val,)
+    guard = idiom["guard"].format(**names)
+    body = [line.format(**names) for line in idiom["body"]]
+    return guard, body
+
+class IntSet:
+    """Set of integers backed by a bitmap for values in [0, 2**bits), with a
+    plain set as overflow for anything outside that range."""
+    def __init__(self, bits=24):
+        self.size = 1 << bits
+        self.bitmap = bytearray(self.size >> 3)
+        self.overflow = set()
+        self.count = 0
+
+    def __contains__(self, n):
+        if 0 <= n < self.size:
+            return self.bitmap[n >> 3] & (1 << (n & 7)) != 0
+        return n in self.overflow
+
+    def __len__(self):
+        return self.count
+
+    def add(self, n):
+        if n in self:
+            return
+        if 0 <= n < self.size:
+            self.bitmap[n >> 3] |= 1 << (n & 7)
+        else:
+            self.overflow.add(n)
+        self.count += 1
+
+class Program:
+    def __init__(self, filename=None, ip=None, instructions=None, nreg=6,
+                 idioms=True):
+        self.filename = filename
+        if filename is not None:
+            ip, instructions = parse(filename)
+        self.ip = ip
+        self.instructions = instructions
+        self.instructions_size = len(self.instructions)
+        self.nreg = nreg
+        self.code = decode(self.instructions)
+        self.idioms = find_idioms(self.instructions, self.ip) if idioms else {}
+        self.plain_funcs = self._compile()
+        self.funcs = self._compile_idioms(self.plain_funcs)
+        self.block_funcs = {}
+        self._reset_reg()
+
+    def _compile(self):
+        """Compile every instruction into a closure that updates the
+        register list in place and returns the next ip.  Reads of the bound
+        ip register are folded into constants, so the register only has to
+        be written back when the program halts."""
+        funcs = []
+        for k, (opnum, a, b, c) in enumerate(self.code):
+            e = expr(opnum, a, b, consts=self._ip_const(k))
+            if c == self.ip:
+                src = "def f(r):\n    return (%s) + 1\n" % (e,)
+            else:
+                src = "def f(r):\n    r[%d] = %s\n    return %d\n" % (c, e, k + 1)
+            env = {}
+            exec(src, env)
+            funcs.append(env["f"])
+        return funcs
+
+    def _compile_idioms(self, funcs):
+        """Replace the instruction at the start of each recognised idiom
+        with a closure that runs the whole loop natively, falling back to
+        the plain instruction when the guard does not hold."""
+        funcs = list(funcs)
+        for k, (idiom, binding) in self.idioms.items():
+            guard, body = idiom_source(idiom, binding, "r[%d]")
+            src = ["def f(r):",
+                   "    if %s:" % (guard,)]
+            src += ["        " + line for line in body]
+            src += ["        return %d" % (k + idiom["exit"],),
+                    "    return fallback(r)"]
+            env = {"divisor_sum": divisor_sum, "fallback": funcs[k]}
+            exec("\n".join(src) + "\n", env)
+            funcs[k] = env["f"]
+        return funcs
+
+    def _idiom_at(self, k, hooked):
+        """The idiom starting at k, unless it would skip over a hook."""
+        if k not in self.idioms:
+            return None
+        idiom, binding = self.idioms[k]
+        if any(h in hooked for h in range(k + 1, k + len(idiom["pattern"]))):
+            return None
+        return idiom, binding
+
+    def _ip_const(self, k):
+        return {} if self.ip is None else {self.ip: k}
+
+    def leaders(self, hooked=frozenset()):
+        """Ips that start a basic block: ip 0, the instruction after any
+        write to the ip register, the static targets of those writes,
+        hooked instructions, and the start and exit of every idiom."""
+        n = self.instructions_size
+        leaders = {0} | set(hooked)
+        for k, (opnum, a, b, c) in enumerate(self.code):
+            if c == self.ip:
+                leaders.add(k + 1)
+                succ = self.successors(k)
+                if len(succ) < n:
+                    leaders.update(succ)
+            found = self._idiom_at(k, hooked)
+            if found is not None:
+                leaders.add(k)
+                leaders.add(k + found[0]["exit"])
+        return {k for k in leaders if 0 <= k < n}
+
+    def _block_source(self, hooked):
+        """Python source for a function that runs the program with the
+        registers held in locals.  Each basic block becomes straight-line
+        code that runs to the next leader or write to the ip register, and
+        the blocks are selected by a binary tree of ip comparisons.  An ip
+        inside a block can only be reached by a computed jump; it gets a
+        single instruction and falls through to the next ip."""
+        n = self.instructions_size
+        leaders = self.leaders(hooked)
+        regs = ", ".join("r%d" % (i,) for i in range(self.nreg))
+        lines = [
+            "def run(%s, hooks):" % (regs,),
+            "    ip = 0",
+            "    steps = 0",
+            "    while 0 <= ip < %d:" % (n,)]
+
+        def block(k, indent):
+            pad = " " * indent
+            out = []
+            if k in hooked:
+                reglist = ", ".join(str(k) if i == self.ip else "r%d" % (i,)
+                                    for i in range(self.nreg))
+                out.append(pad + "reg = [%s]" % (reglist,))
+                out.append(pad + "try:")
+                out.append(pad + "    hooks[%d](reg, steps)" % (k,))
+                out.append(pad + "except Halt:")
+                out.append(pad + "    return reg, steps")
+            found = self._idiom_at(k, hooked)
+            if found is not None:
+                idiom, binding = found
+                guard, body = idiom_source(idiom, binding, "r%d")
+                out.append(pad + "if %s:" % (guard,))
+                out += [pad + "    " + line for line in body]
+                out.append(pad + "    ip = %d" % (k + idiom["exit"],))
+                out.append(pad + "    continue")
+            j = k
+            while True:
+                if j == n or (j > k and (j in leaders or k not in leaders)):
+                    out.append(pad + "ip = %d" % (j,))
+                    break
+                opnum, a, b, c = self.code[j]
+                e = expr(opnum, a, b, regfmt="r%d", consts=self._ip_const(j))
+                j += 1
+                if c == self.ip:
+                    out.append(pad + "ip = (%s) + 1" % (e,))
+                    break
+                out.append(pad + "r%d = %s" % (c, e))
+            out.append(pad + "steps += %d" % (j - k,))
+            return out
+
+        def tree(lo, hi, indent):
+            pad = " " * indent
+            if hi - lo == 1:
+                return block(lo, indent)
+            mid = (lo + hi) // 2
+            return ([pad + "if ip < %d:" % (mid,)] + tree(lo, mid, indent + 4)
+                    + [pad + "else:"] + tree(mid, hi, indent + 4))
+
+        lines += tree(0, n, 8)
+        if self.ip is not None:
+            lines.append("    r%d = ip" % (self.ip,))
+        lines.append("    return [%s], steps" % (regs,))
+        return "\n".join(lines) + "\n"
+
+    def _compile_blocks(self, hooked=frozenset()):
+        if hooked not in self.block_funcs:
+            env = {"Halt": Halt, "divisor_sum": divisor_sum}
+            exec(self._block_source(hooked), env)
+            self.block_funcs[hooked] = env["run"]
+        return self.block_funcs[hooked]
+
+    def successors(self, k):
+        """Possible next ips after instruction k."""
+        opnum, a, b, c = self.code[k]
+        name = OPNAMES[opnum]
+        if c != self.ip:
+            return [k + 1]
+        if name == "seti":
+            return [a + 1]
+        if name == "addi" and a == self.ip:
+            return [k + b + 1]
+        if name == "addr" and self.ip in (a, b) and k > 0:
+            # skip ahead by a flag set by the previous comparison
+            flag = b if a == self.ip else a
+            popnum, _, _, pc = self.code[k - 1]
+            if pc == flag and OPNAMES[popnum][:2] in ("gt", "eq"):
+                return [k + 1, k + 2]
+        return list(range(self.instructions_size))
+
+    def live_registers(self, k):
+        """Registers whose value on reaching ip k can affect the rest of the
+        run.  The ip register and registers the program never writes
+        (such as an input in r0) are excluded."""
+        n = self.instructions_size
+        written = {c for _, _, _, c in self.code}
+        reads = []
+        for opnum, a, b, c in self.code:
+            r = set()
+            if "{ra}" in EXPRS[opnum]:
+                r.add(a)
+            if "{rb}" in EXPRS[opnum]:
+                r.add(b)
+            reads.append(r)
+        live = [set() for _ in range(n)]
+        changed = True
+        while changed:
+            changed = False
+            for j in range(n - 1, -1, -1):
+                out = set()
+                for s in self.successors(j):
+                    if 0 <= s < n:
+                        out |= live[s]
+                new = (out - {self.code[j][3]}) | reads[j]
+                if new != live[j]:
+                    live[j] = new
+                    changed = True
+        return sorted((live[k] & written) - {self.ip})
+
+    def scan_halting(self, k, bits=24, mode="blocks"):
+        """For a program that halts when the register compared against r0
+        at ip k equals r0, find the first and last distinct values that
+        would halt it.  Runs with an r0 that never matches, stopping as
+        soon as the loop-carried state at k repeats."""
+        opnum, a, b, c = self.code[k]
+        if OPNAMES[opnum] != "eqrr" or 0 not in (a, b):
+            raise ValueError("ip %d does not compare against r0" % (k,))
+        vreg = b if a == 0 else a
+        live = self.live_registers(k)
+        seen_values = IntSet(bits)
+        if live == [vreg]:
+            seen_states = seen_values
+        else:
+            seen_states = set()
+        found = [None, None]
+
+        def check(reg, steps):
+            state = reg[vreg] if live == [vreg] else tuple(reg[i] for i in live)
+            if state in seen_states:
+                raise Halt()
+            value = reg[vreg]
+            if value not in seen_values:
+                if found[0] is None:
+                    found[0] = value
+                found[1] = value
+                seen_values.add(value)
+            if seen_states is not seen_values:
+                seen_states.add(state)
+
+        self.run(r0=-1, hooks={k: check}, mode=mode)
+        return tuple(found)
+
+    def _reset_reg(self):
+        self.reg = [0] * self.nreg
+
+    def run(self, debug=0, r0=0, hooks=None, mode="closures"):
+        """Run from the start until the ip leaves the program.  hooks maps
+        an ip to a callable(reg, steps) invoked before that instruction
+        executes; a hook may raise Halt to stop.  mode="blocks" runs the
+        program as compiled basic blocks instead of one closure per
+        instruction.  Returns the number of instructions executed, not
+        counting those replaced by a recognised idiom (debug runs never use
+        idioms)."""
+        self._reset_reg()
+        self.reg[0] = r0
+        try:
+            if mode == "blocks" and not debug:
+                return self._run_blocks(hooks or {})
+            elif debug:
+                return self._run_debug(debug, hooks or {})
+            elif hooks:
+                return self._run_hooks(hooks)
+            else:
+                return self._run_fast()
+        except Halt:
+            return self.steps
+
+    def profile(self, r0=0, max_steps=None, top=10):
+        """Run the plain instructions (no idioms) while counting executions
+        per ip and per ip -> next ip edge, then print the hottest
+        instructions and the back-edges, which mark the loops.  Stops after
+        max_steps instructions if given.  Counts are kept in ip_counts and
+        edge_counts (indexed by src * n + dst)."""
+        self._reset_reg()
+        self.reg[0] = r0
+        reg = self.reg
+        funcs = self.plain_funcs
+        n = self.instructions_size
+        ip_counts = array("q", bytes(8 * n))
+        edge_counts = array("q", bytes(8 * n * n))
+        limit = -1 if max_steps is None else max_steps
+        steps = 0
+        ip = 0
+        while 0 <= ip < n and steps != limit:
+            nip = funcs[ip](reg)
+            ip_counts[ip] += 1
+            if 0 <= nip < n:
+                edge_counts[ip * n + nip] += 1
+            ip = nip
+            steps += 1
+        if self.ip is not None:
+            reg[self.ip] = ip
+        self.steps = steps
+        self.ip_counts = ip_counts
+        self.edge_counts = edge_counts
+        self.print_profile(top)
+        return steps
+
+    def print_profile(self, top=10):
+        n = self.instructions_size
+        print("%d instructions executed" % (self.steps,))
+        print("hot instructions:")
+        ranked = sorted(range(n), key=lambda k: -self.ip_counts[k])
+        for k in ranked[:top]:
+            if self.ip_counts[k] == 0:
+                break
+            op, a, b, c = self.instructions[k]
+            print("  %3d %-4s %d %d %d %12d %5.1f%%" % (
+                    k, op, a, b, c, self.ip_counts[k],
+                    100.0 * self.ip_counts[k] / max(self.steps, 1)))
+        print("back-edges:")
+        for src in range(n):
+            for dst in range(src + 1):
+                count = self.edge_counts[src * n + dst]
+                if count:
+                    print("  %3d -> %3d %12d" % (src, dst, count))
+
+    def _run_fast(self):
+        reg = self.reg
+        funcs = self.funcs
+        n = self.instructions_size
+        steps = 0
+        ip = 0
+        while 0 <= ip < n:
+            ip = funcs[ip](reg)
+            steps += 1
+        if self.ip is not None:
+            reg[self.ip] = ip
+        self.steps = steps
+        return steps
+
+    def _run_blocks(self, hooks):
+        f = self._compile_blocks(frozenset(hooks))
+        self.reg, self.steps = f(*self.reg, hooks)
+        return self.steps
+
+    def _run_hooks(self, hooks):
+        reg = self.reg
+        funcs = self.funcs
+        n = self.instructions_size
+        ipreg = self.ip
+        hooked = [hooks.get(i) for i in range(n)]
+        funcs = list(funcs)
+        for k in self.idioms:
+            if self._idiom_at(k, hooks) is None:
+                funcs[k] = self.plain_funcs[k]
+        steps = 0
+        ip = 0
+        while 0 <= ip < n:
+            h = hooked[ip]
+            if h is not None:
+                if ipreg is not None:
+                    reg[ipreg] = ip
+                self.steps = steps
+                h(reg, steps)
+            ip = funcs[ip](reg)
+            steps += 1
+        if ipreg is not None:
+            reg[ipreg] = ip
+        self.steps = steps
+        return steps
+
+    def _run_debug(self, debug, hooks):
+        reg = self.reg
+        n = self.instructions_size
+        ipreg = self.ip
+        self.steps = 0
+        ip = 0
+        while 0 <= ip < n:
+            if ipreg is not None:
+                reg[ipreg] = ip
+            if ((self.steps + 1) % 100000) == 0:
+                print("%10d %s" % (self.steps + 1, reg))
+            if ip in hooks:
+                hooks[ip](reg, self.steps)
+            op, a, b, c = self.instructions[ip]
+            if debug >= 2:
+                print("ip=%d %s %s %d %d %d" % (ip, reg, op, a, b, c), end="")
+            ip = self.plain_funcs[ip](reg)
+            if ipreg is not None:
+                reg[ipreg] = ip - 1
+            if debug >= 2:
+                print(" %s" % (reg,))
+            self.steps += 1
+        if ipreg is not None:
+            reg[ipreg] = ip
+        return self.steps